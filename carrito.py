@@ -0,0 +1,86 @@
+"""Modelo del carrito de venta.
+
+Los importes se guardan en centavos enteros para que el total sea exacto sin
+importar cuántas líneas tenga el carrito. Cada operación ajusta el total con
+la diferencia de la línea afectada, sin recorrer el resto del carrito.
+"""
+
+
+def a_centavos(monto):
+    """Convierte un precio (REAL de la base de datos o texto) a centavos enteros."""
+    return int(round(float(monto) * 100))
+
+
+def formatear_centavos(centavos):
+    signo = "-" if centavos < 0 else ""
+    centavos = abs(centavos)
+    return f"{signo}C${centavos // 100}.{centavos % 100:02d}"
+
+
+class LineaCarrito:
+    __slots__ = ("producto_id", "nombre", "precio_centavos", "cantidad")
+
+    def __init__(self, producto_id, nombre, precio_centavos, cantidad):
+        self.producto_id = producto_id
+        self.nombre = nombre
+        self.precio_centavos = precio_centavos
+        self.cantidad = cantidad
+
+    @property
+    def subtotal_centavos(self):
+        return self.precio_centavos * self.cantidad
+
+
+class Carrito:
+    def __init__(self):
+        self.lineas = {}  # producto_id -> LineaCarrito (en orden de escaneo)
+        self.total_centavos = 0
+
+    def __len__(self):
+        return len(self.lineas)
+
+    def __iter__(self):
+        return iter(self.lineas.values())
+
+    def __contains__(self, producto_id):
+        return producto_id in self.lineas
+
+    def cantidad_de(self, producto_id):
+        linea = self.lineas.get(producto_id)
+        return linea.cantidad if linea else 0
+
+    def agregar(self, producto_id, nombre, precio, cantidad):
+        """Suma 'cantidad' unidades del producto (nueva línea o acumulada). Devuelve la línea afectada."""
+        if cantidad <= 0:
+            raise ValueError("La cantidad debe ser un número entero positivo.")
+
+        linea = self.lineas.get(producto_id)
+        if linea is None:
+            linea = LineaCarrito(producto_id, nombre, a_centavos(precio), 0)
+            self.lineas[producto_id] = linea
+
+        linea.cantidad += cantidad
+        self.total_centavos += linea.precio_centavos * cantidad
+        return linea
+
+    def cambiar_cantidad(self, producto_id, cantidad):
+        """Fija la cantidad de una línea; con 0 la quita. Devuelve la línea (o None si se quitó)."""
+        if cantidad < 0:
+            raise ValueError("La cantidad no puede ser negativa.")
+        if cantidad == 0:
+            self.quitar(producto_id)
+            return None
+
+        linea = self.lineas[producto_id]
+        self.total_centavos += linea.precio_centavos * (cantidad - linea.cantidad)
+        linea.cantidad = cantidad
+        return linea
+
+    def quitar(self, producto_id):
+        linea = self.lineas.pop(producto_id)
+        self.total_centavos -= linea.subtotal_centavos
+        return linea
+
+    def vaciar(self):
+        self.lineas = {}
+        self.total_centavos = 0
@@ -0,0 +1,298 @@
+"""Consolidación de las bases de datos de varias tiendas en una base central de análisis.
+
+Cada tienda tiene su propio pos_data.db con los ids autoincrementales locales.
+La base central guarda cada fila con el id de la tienda y su id local (único
+por tienda) y le asigna un id central propio, así las ventas #1 de dos tiendas
+no chocan.
+
+La importación es incremental: por tienda y por tabla se guarda una marca de
+agua en la misma transacción que los datos. En cada corrida solo se leen:
+  - ventas: las de id local mayor a la marca, más las ventas anteriores
+    devueltas desde la última corrida (índice por fecha_devolucion; se relee
+    el segundo de la marca porque la fecha no distingue devoluciones del
+    mismo segundo, y reaplicarlas no cambia nada). Las tiendas con el esquema
+    anterior, sin fecha_devolucion, se leen igual: sus devoluciones se buscan
+    por es_devolucion hasta que aparece la primera devolución con fecha;
+  - caja: desde la caja más antigua que seguía abierta en la corrida anterior;
+  - productos: el catálogo completo (es pequeño), pero solo se escriben las
+    filas que cambiaron.
+
+Las tiendas se leen en paralelo en un pool de procesos (solo lectura, una
+transacción por tienda para tener una foto consistente); la escritura en la
+base central la hace un único proceso, una transacción por tienda.
+
+Uso:
+    python consolidacion.py --central central.db tiendas/*.db
+    python consolidacion.py --central central.db T01=/respaldos/t01/pos_data.db T02=/respaldos/t02/pos_data.db
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mantenimiento import conectar
+from operaciones import ahora
+
+logger = logging.getLogger(__name__)
+
+
+# ====================================================================
+#           ESQUEMA DE LA BASE CENTRAL
+# ====================================================================
+
+def crear_esquema_central(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tiendas (
+            id TEXT PRIMARY KEY,
+            ruta TEXT NOT NULL,
+            ultima_consolidacion TEXT
+        )
+    ''')
+    # Marcas de agua por tienda: última venta importada, última devolución vista y
+    # primera caja que hay que volver a leer (la más antigua que seguía abierta)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS marcas_consolidacion (
+            tienda TEXT PRIMARY KEY,
+            ultima_venta INTEGER NOT NULL DEFAULT 0,
+            ultima_devolucion TEXT NOT NULL DEFAULT '',
+            primera_caja INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS productos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tienda TEXT NOT NULL,
+            id_local INTEGER NOT NULL,
+            nombre TEXT NOT NULL,
+            categoria TEXT,
+            descripcion TEXT,
+            stock INTEGER NOT NULL,
+            precio REAL NOT NULL,
+            UNIQUE (tienda, id_local)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tienda TEXT NOT NULL,
+            id_local INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            total REAL NOT NULL,
+            detalles TEXT NOT NULL,
+            es_devolucion INTEGER DEFAULT 0,
+            fecha_devolucion TEXT,
+            UNIQUE (tienda, id_local)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caja (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tienda TEXT NOT NULL,
+            id_local INTEGER NOT NULL,
+            estado TEXT NOT NULL,
+            fecha_apertura TEXT NOT NULL,
+            fecha_cierre TEXT,
+            ganancia_total REAL,
+            UNIQUE (tienda, id_local)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_tienda_fecha ON ventas (tienda, fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_caja_tienda_apertura ON caja (tienda, fecha_apertura)")
+
+
+# ====================================================================
+#           LECTURA DE UNA TIENDA (se ejecuta en los procesos del pool)
+# ====================================================================
+
+def leer_tienda(ruta, marca):
+    """Lee lo nuevo de una tienda desde la marca (ultima_venta, ultima_devolucion, primera_caja).
+
+    Devuelve un dict con las filas a escribir y la marca siguiente.
+    """
+    inicio = time.perf_counter()
+    ultima_venta, ultima_devolucion, primera_caja = marca
+    # Solo lectura: la tienda puede seguir vendiendo si se consolida en caliente
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, timeout=30)
+    try:
+        # Las tiendas que todavía no abrieron el POS actualizado no tienen la columna fecha_devolucion
+        columnas = [col[1] for col in conn.execute("PRAGMA table_info(ventas)")]
+        con_fecha_devolucion = "fecha_devolucion" in columnas
+
+        conn.execute("BEGIN")  # Una sola foto de la base para las tres tablas
+        productos = conn.execute(
+            "SELECT id, nombre, categoria, descripcion, stock, precio FROM productos").fetchall()
+        ventas = conn.execute(
+            "SELECT id, fecha, total, detalles, es_devolucion, "
+            f"{'fecha_devolucion' if con_fecha_devolucion else 'NULL AS fecha_devolucion'} FROM ventas WHERE id > ?",
+            (ultima_venta,)).fetchall()
+        devoluciones = []
+        ultima_fecha = None
+        if con_fecha_devolucion:
+            # Ventas ya importadas que se devolvieron después (una búsqueda por el índice parcial).
+            # '>=': una devolución en el mismo segundo que la marca, pero confirmada después de leerla, no se pierde
+            devoluciones = conn.execute(
+                "SELECT id, fecha_devolucion FROM ventas WHERE fecha_devolucion >= ? AND id <= ?",
+                (ultima_devolucion, ultima_venta)).fetchall()
+            # IS NOT NULL: así el MAX sale del índice parcial (una lectura) y no de recorrer la tabla
+            ultima_fecha = conn.execute(
+                "SELECT MAX(fecha_devolucion) FROM ventas WHERE fecha_devolucion IS NOT NULL").fetchone()[0]
+        if not ultima_devolucion:
+            # Devoluciones sin fecha (hechas antes de existir la columna): se buscan por es_devolucion
+            # recorriendo la tabla. Solo mientras la tienda no tenga ninguna devolución con fecha; la
+            # primera corrida que ve una ya encontró todas las anteriores.
+            devoluciones += conn.execute(
+                "SELECT id, NULL FROM ventas WHERE es_devolucion=1 AND id <= ?"
+                + (" AND fecha_devolucion IS NULL" if con_fecha_devolucion else ""),
+                (ultima_venta,)).fetchall()
+        cajas = conn.execute(
+            "SELECT id, estado, fecha_apertura, fecha_cierre, ganancia_total FROM caja WHERE id >= ?",
+            (primera_caja,)).fetchall()
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    abiertas = [caja[0] for caja in cajas if caja[1] == 'Abierta']
+    siguiente = (
+        max([ultima_venta] + [venta[0] for venta in ventas]),
+        max(ultima_devolucion, ultima_fecha or ''),
+        min(abiertas) if abiertas else max([primera_caja - 1] + [caja[0] for caja in cajas]) + 1,
+    )
+    return {
+        "productos": productos,
+        "ventas": ventas,
+        "devoluciones": devoluciones,
+        "cajas": cajas,
+        "marca": siguiente,
+        "segundos_lectura": time.perf_counter() - inicio,
+    }
+
+
+# ====================================================================
+#           ESCRITURA EN LA BASE CENTRAL
+# ====================================================================
+
+def obtener_marca(cursor, tienda):
+    cursor.execute("SELECT ultima_venta, ultima_devolucion, primera_caja FROM marcas_consolidacion WHERE tienda=?",
+                   (tienda,))
+    return cursor.fetchone() or (0, '', 0)
+
+
+def escribir_tienda(conn, tienda, ruta, lectura):
+    """Aplica lo leído de una tienda y avanza su marca, todo en una transacción. Devuelve filas escritas."""
+    cursor = conn.cursor()
+    antes = conn.total_changes
+    with conn:
+        # El id central lo asigna la base central; (tienda, id_local) identifica la fila de origen.
+        # En conflicto solo se actualiza si algo cambió, para no reescribir el catálogo entero cada noche.
+        cursor.executemany('''
+            INSERT INTO productos (tienda, id_local, nombre, categoria, descripcion, stock, precio)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (tienda, id_local) DO UPDATE SET
+                nombre=excluded.nombre, categoria=excluded.categoria, descripcion=excluded.descripcion,
+                stock=excluded.stock, precio=excluded.precio
+            WHERE (nombre, categoria, descripcion, stock, precio)
+                IS NOT (excluded.nombre, excluded.categoria, excluded.descripcion, excluded.stock, excluded.precio)
+        ''', [(tienda, *fila) for fila in lectura["productos"]])
+
+        cursor.executemany('''
+            INSERT INTO ventas (tienda, id_local, fecha, total, detalles, es_devolucion, fecha_devolucion)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (tienda, id_local) DO NOTHING
+        ''', [(tienda, *fila) for fila in lectura["ventas"]])
+        # Las devoluciones ya aplicadas (las del segundo de la marca, o las sin fecha) no se reescriben
+        cursor.executemany(
+            "UPDATE ventas SET es_devolucion=1, fecha_devolucion=? "
+            "WHERE tienda=? AND id_local=? AND (es_devolucion IS NOT 1 OR fecha_devolucion IS NOT ?)",
+            [(fecha, tienda, venta_id, fecha) for venta_id, fecha in lectura["devoluciones"]])
+
+        cursor.executemany('''
+            INSERT INTO caja (tienda, id_local, estado, fecha_apertura, fecha_cierre, ganancia_total)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (tienda, id_local) DO UPDATE SET
+                estado=excluded.estado, fecha_cierre=excluded.fecha_cierre, ganancia_total=excluded.ganancia_total
+        ''', [(tienda, *fila) for fila in lectura["cajas"]])
+
+        cursor.execute('''
+            INSERT INTO marcas_consolidacion (tienda, ultima_venta, ultima_devolucion, primera_caja)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (tienda) DO UPDATE SET ultima_venta=excluded.ultima_venta,
+                ultima_devolucion=excluded.ultima_devolucion, primera_caja=excluded.primera_caja
+        ''', (tienda, *lectura["marca"]))
+        cursor.execute('''
+            INSERT INTO tiendas (id, ruta, ultima_consolidacion) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET ruta=excluded.ruta, ultima_consolidacion=excluded.ultima_consolidacion
+        ''', (tienda, ruta, ahora()))
+    return conn.total_changes - antes
+
+
+def consolidar(central, tiendas, procesos=None):
+    """tiendas: {id_tienda: ruta}. Devuelve {id_tienda: (filas escritas, segundos) o el error}."""
+    inicio = time.perf_counter()
+    conn = conectar(central, timeout=30)
+    crear_esquema_central(conn.cursor())
+    conn.commit()
+    marcas = {tienda: obtener_marca(conn.cursor(), tienda) for tienda in tiendas}
+
+    resultados = {}
+    try:
+        with ProcessPoolExecutor(max_workers=procesos or os.cpu_count() or 1) as pool:
+            futuros = {pool.submit(leer_tienda, ruta, marcas[tienda]): tienda for tienda, ruta in tiendas.items()}
+            # Cada tienda se escribe en cuanto termina su lectura, mientras las demás se siguen leyendo
+            for futuro in as_completed(futuros):
+                tienda = futuros[futuro]
+                try:
+                    lectura = futuro.result()
+                    inicio_escritura = time.perf_counter()
+                    filas = escribir_tienda(conn, tienda, tiendas[tienda], lectura)
+                    resultados[tienda] = (filas, lectura["segundos_lectura"] + time.perf_counter() - inicio_escritura)
+                    logger.info("Tienda %s: %d ventas nuevas, %d devoluciones, %d cajas, %d filas escritas "
+                                "(lectura %.2f s, escritura %.2f s)", tienda, len(lectura["ventas"]),
+                                len(lectura["devoluciones"]), len(lectura["cajas"]), filas,
+                                lectura["segundos_lectura"], time.perf_counter() - inicio_escritura)
+                except Exception as e:
+                    # La marca de la tienda no avanzó: la próxima corrida vuelve a intentar desde el mismo punto
+                    resultados[tienda] = e
+                    logger.error("No se pudo consolidar la tienda %s (%s): %s", tienda, tiendas[tienda], e)
+    finally:
+        conn.execute("PRAGMA optimize")
+        conn.close()
+
+    logger.info("Consolidación de %d tiendas en %.1f s", len(tiendas), time.perf_counter() - inicio)
+    return resultados
+
+
+def parsear_tiendas(argumentos):
+    """'ID=ruta' o solo 'ruta' (el id es el nombre del archivo, o de su carpeta si es pos_data.db)."""
+    tiendas = {}
+    for argumento in argumentos:
+        tienda, separador, ruta = argumento.partition("=")
+        if not separador:
+            ruta = argumento
+            nombre = os.path.splitext(os.path.basename(ruta))[0]
+            tienda = os.path.basename(os.path.dirname(os.path.abspath(ruta))) if nombre == "pos_data" else nombre
+        if tienda in tiendas:
+            raise ValueError(f"Id de tienda repetido: {tienda}")
+        tiendas[tienda] = ruta
+    return tiendas
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Consolida las bases de datos de las tiendas en una base central.")
+    parser.add_argument("tiendas", nargs="+", help="Bases de las tiendas: 'ID=ruta' o solo la ruta")
+    parser.add_argument("--central", default="central.db", help="Base de datos central")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos de lectura (por defecto, uno por núcleo)")
+    args = parser.parse_args()
+
+    try:
+        tiendas = parsear_tiendas(args.tiendas)
+    except ValueError as e:
+        parser.error(str(e))
+    resultados = consolidar(args.central, tiendas, args.procesos)
+    errores = [tienda for tienda, resultado in resultados.items() if isinstance(resultado, Exception)]
+    print(f"{len(resultados) - len(errores)} tiendas consolidadas, {len(errores)} con errores")
+    raise SystemExit(1 if errores else 0)
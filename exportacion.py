@@ -0,0 +1,267 @@
+"""Exportación de ventas por períodos en varios formatos, en paralelo.
+
+Un trabajo lee las ventas del año una sola vez, las reparte por mes y manda
+cada combinación (mes, formato) a un pool de procesos, uno por núcleo. Los
+trabajos se encolan y se ejecutan desde un hilo en segundo plano, así la caja
+puede seguir vendiendo mientras tanto. El progreso y la duración de cada
+trabajo y de cada archivo quedan en TrabajoExportacion.
+
+Uso manual:
+    python exportacion.py --anio 2024 --destino exportaciones
+"""
+import argparse
+import csv
+import datetime
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = ("pdf", "xlsx", "csv")
+COLUMNAS_EXCEL = ["ID Venta", "Fecha", "Total", "Detalles de Venta", "Es Devolución (1/0)"]
+
+
+# ====================================================================
+#           RENDERIZADO (se ejecuta en los procesos del pool)
+# ====================================================================
+
+def generar_pdf_ventas(filepath, data, titulo, ajustes_hasta_id=0):
+    # Las devoluciones de ventas con id <= ajustes_hasta_id ya se reportaron como vendidas
+    # en una exportación anterior, por eso se restan del total neto.
+    doc = SimpleDocTemplate(filepath, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elementos = []
+
+    elementos.append(Paragraph(titulo, styles['h1']))
+    elementos.append(Paragraph(f"Fecha de Reporte: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                               styles['Normal']))
+    elementos.append(Paragraph("<br/>", styles['Normal']))
+
+    header = ["ID Venta", "Fecha", "Total", "Detalles", "Estado"]
+    table_data = [header]
+    total_ventas = 0.0
+
+    for row in data:
+        # CAMBIO 15: Reemplazar $ por C$ al mostrar el total
+        total_str = f"C${row[2]:.2f}"
+        detalles_str = row[3].replace('$', 'C$')  # Asegurar que los detalles en el PDF también usen C$
+
+        if row[4] == 0:
+            total_ventas += row[2]  # Solo suma las ventas no devueltas al total general
+            estado = "VENDIDO"
+        else:
+            if row[0] <= ajustes_hasta_id:
+                total_ventas -= row[2]
+            estado = "DEVOLUCIÓN"
+
+        table_data.append([row[0], row[1].split(' ')[0], total_str, detalles_str, estado])
+
+    table = Table(table_data, colWidths=[50, 80, 70, 270, 70])
+
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('ALIGN', (2, 1), (2, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ])
+    table.setStyle(style)
+    elementos.append(table)
+
+    elementos.append(Paragraph("<br/>", styles['Normal']))
+    # CAMBIO 16: Reemplazar $ por C$ en el total neto del PDF
+    elementos.append(
+        Paragraph(f"TOTAL NETO DE VENTAS (SIN DEVOLUCIONES): <font color='red'>C${total_ventas:.2f}</font>",
+                  styles['h3']))
+
+    doc.build(elementos)
+
+
+def generar_excel_ventas(filepath, data):
+    df = pd.DataFrame([row[:5] for row in data], columns=COLUMNAS_EXCEL)
+    # Forzamos el cambio de $ a C$ en los detalles antes de exportar
+    df['Detalles de Venta'] = df['Detalles de Venta'].str.replace('$', 'C$')
+    df.to_excel(filepath, index=False)
+
+
+def generar_csv_ventas(filepath, data):
+    # utf-8-sig para que Excel reconozca los acentos al abrir el CSV
+    with open(filepath, "w", newline="", encoding="utf-8-sig") as archivo:
+        writer = csv.writer(archivo)
+        writer.writerow(COLUMNAS_EXCEL)
+        for row in data:
+            writer.writerow([row[0], row[1], f"{row[2]:.2f}", row[3].replace('$', 'C$'), row[4]])
+
+
+def renderizar_periodo(formato, periodo, data, carpeta):
+    """Genera el archivo de un período en un formato. Devuelve (ruta, segundos, filas)."""
+    inicio = time.perf_counter()
+    ruta = os.path.join(carpeta, f"ventas_{periodo}.{formato}")
+    if formato == "pdf":
+        generar_pdf_ventas(ruta, data, f"REPORTE DE VENTAS {periodo}")
+    elif formato == "xlsx":
+        generar_excel_ventas(ruta, data)
+    elif formato == "csv":
+        generar_csv_ventas(ruta, data)
+    else:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    return ruta, time.perf_counter() - inicio, len(data)
+
+
+# ====================================================================
+#           LECTURA Y REPARTO POR PERÍODO
+# ====================================================================
+
+def leer_ventas_por_mes(db_path, anio):
+    """Lee una sola vez las ventas del año (por el índice de fecha) y las agrupa por 'AAAA-MM'."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        cursor = conn.execute(
+            "SELECT id, fecha, total, detalles, es_devolucion FROM ventas WHERE fecha >= ? AND fecha < ? ORDER BY id",
+            (f"{anio}-01-01", f"{anio + 1}-01-01"))
+        periodos = {}
+        for row in cursor:
+            periodos.setdefault(row[1][:7], []).append(row)
+        return periodos
+    finally:
+        conn.close()
+
+
+class TrabajoExportacion:
+    def __init__(self, numero, anio, formatos, carpeta):
+        self.numero = numero
+        self.anio = anio
+        self.formatos = formatos
+        self.carpeta = carpeta
+
+        self.estado = "En cola"
+        self.total = 0
+        self.completados = 0
+        self.errores = []
+        self.archivos = []  # (ruta, segundos, filas)
+        self.inicio = None
+        self.fin = None
+
+    @property
+    def terminado(self):
+        return self.fin is not None
+
+    @property
+    def segundos(self):
+        if self.inicio is None:
+            return 0.0
+        return (self.fin or time.perf_counter()) - self.inicio
+
+    def resumen(self):
+        if self.estado == "En cola":
+            return f"Trabajo #{self.numero} ({self.anio}): en cola"
+        texto = f"Trabajo #{self.numero} ({self.anio}): {self.completados}/{self.total} archivos, {self.segundos:.1f} s"
+        if self.errores:
+            texto += f", {len(self.errores)} errores"
+        return texto if not self.terminado else f"{texto} - {self.estado}"
+
+
+class EjecutorExportaciones:
+    def __init__(self, db_path, procesos=None):
+        self.db_path = db_path
+        self.procesos = procesos or os.cpu_count() or 1
+        self.trabajos = []
+
+        self._cola = queue.Queue()
+        self._pool = None
+        self._hilo = None
+        self._contador = 0
+
+    def encolar(self, anio, carpeta, formatos=FORMATOS):
+        self._contador += 1
+        trabajo = TrabajoExportacion(self._contador, anio, tuple(formatos), carpeta)
+        self.trabajos.append(trabajo)
+        self._cola.put(trabajo)
+
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="exportaciones-pos", daemon=True)
+            self._hilo.start()
+        return trabajo
+
+    def detener(self):
+        self._cola.put(None)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _bucle(self):
+        while True:
+            trabajo = self._cola.get()
+            if trabajo is None:
+                break
+            try:
+                self.ejecutar(trabajo)
+            except Exception as e:
+                trabajo.errores.append(str(e))
+                trabajo.estado = "Error"
+                trabajo.fin = time.perf_counter()
+                logger.exception("Falló el trabajo de exportación #%d", trabajo.numero)
+
+    def ejecutar(self, trabajo):
+        trabajo.estado = "En proceso"
+        trabajo.inicio = time.perf_counter()
+        os.makedirs(trabajo.carpeta, exist_ok=True)
+
+        periodos = leer_ventas_por_mes(self.db_path, trabajo.anio)
+        trabajo.total = len(periodos) * len(trabajo.formatos)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+
+        futuros = {
+            self._pool.submit(renderizar_periodo, formato, periodo, data, trabajo.carpeta): (periodo, formato)
+            for periodo, data in periodos.items()
+            for formato in trabajo.formatos
+        }
+        for futuro in as_completed(futuros):
+            periodo, formato = futuros[futuro]
+            try:
+                ruta, segundos, filas = futuro.result()
+                trabajo.archivos.append((ruta, segundos, filas))
+                logger.info("Exportado %s (%d ventas) en %.2f s", ruta, filas, segundos)
+            except Exception as e:
+                trabajo.errores.append(f"{periodo} {formato}: {e}")
+                logger.error("No se pudo exportar %s en %s: %s", periodo, formato, e)
+            trabajo.completados += 1
+
+        trabajo.estado = "Terminado" if not trabajo.errores else "Terminado con errores"
+        trabajo.fin = time.perf_counter()
+        logger.info(trabajo.resumen())
+        return trabajo
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Exporta las ventas de un año por mes en PDF, Excel y CSV.")
+    parser.add_argument("--db", default="pos_data.db", help="Base de datos del POS")
+    parser.add_argument("--anio", type=int, default=datetime.date.today().year, help="Año a exportar")
+    parser.add_argument("--destino", default="exportaciones", help="Carpeta de salida")
+    parser.add_argument("--formatos", default=",".join(FORMATOS), help="Formatos separados por coma (pdf,xlsx,csv)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto, uno por núcleo)")
+    args = parser.parse_args()
+
+    ejecutor = EjecutorExportaciones(args.db, args.procesos)
+    resultado = ejecutor.ejecutar(TrabajoExportacion(1, args.anio, args.formatos.split(","), args.destino))
+    ejecutor.detener()
+    print(resultado.resumen())
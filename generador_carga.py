@@ -0,0 +1,341 @@
+"""Generador de carga: simula un día de caja sin pantalla.
+
+Recorre las mismas funciones que usan los botones del POS (operaciones.py,
+repositorio.py y carrito.py): buscar producto y añadir al carrito, finalizar venta, devolución,
+recepción de mercancía y búsquedas. Las llegadas de clientes siguen un perfil
+por hora (por defecto con pico al mediodía) y el tamaño de la canasta una
+distribución configurable. Al final imprime histogramas de latencia por
+operación, el rendimiento y el crecimiento de la base de datos por hora simulada.
+
+Con --respaldo N se piden respaldos en línea (respaldo.GestorRespaldos) cada N
+minutos simulados mientras se vende; al final se verifica cada copia y se
+compara la latencia de las ventas hechas con y sin un respaldo en curso.
+
+Ejemplos:
+    python generador_carga.py --db carga.db --ventas-dia 3000
+    python generador_carga.py --db carga.db --ventas-dia 6000 --perfil 1,1,2,4,8,4,2,2,3,5,3,1 --canasta-media 6
+    python generador_carga.py --db carga.db --ventas-dia 3000 --velocidad 120 --respaldo 60
+"""
+import argparse
+import bisect
+import math
+import os
+import random
+import time
+
+from carrito import Carrito
+from mantenimiento import conectar
+from operaciones import (abrir_caja, cerrar_caja, crear_esquema, recibir_mercancia, registrar_devolucion,
+                         registrar_venta)
+from repositorio import SENTENCIAS_EN_CACHE, Repositorio
+from respaldo import GestorRespaldos, listar_respaldos, verificar_respaldo
+
+# Peso relativo de llegadas por hora desde la apertura (8:00 a 20:00, pico de almuerzo y de salida)
+PERFIL_DIA = [2, 3, 4, 6, 10, 9, 5, 4, 5, 7, 6, 3]
+HORA_APERTURA = 8
+
+# Latencia a partir de la cual el cajero nota la espera al finalizar una venta
+UMBRAL_LATENCIA_MS = 100
+
+# Límites (ms) de las barras del histograma de latencia
+LIMITES_HISTOGRAMA_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, math.inf]
+
+CATEGORIAS = ["Bebidas", "Abarrotes", "Lácteos", "Limpieza", "Snacks", "Panadería", "Higiene", "Congelados"]
+
+
+# ====================================================================
+#           CATÁLOGO Y PERFIL DE TRÁFICO
+# ====================================================================
+
+def sembrar_catalogo(repo, cantidad, rng):
+    """Crea productos de prueba si la base tiene menos de 'cantidad'."""
+    existentes = repo.productos.contar()
+    filas = [(f"Producto {i:05d}", rng.choice(CATEGORIAS), "Generado por generador_carga", rng.randint(200, 2000),
+              round(rng.uniform(5, 500), 2))
+             for i in range(existentes, cantidad)]
+    repo.productos.insertar_varios(filas)
+
+
+def llegadas_del_dia(ventas_dia, perfil, rng):
+    """Instantes (segundos desde la apertura) de llegada de clientes: Poisson con tasa distinta por hora."""
+    suma = sum(perfil)
+    llegadas = []
+    for hora, peso in enumerate(perfil):
+        tasa = ventas_dia * peso / suma / 3600  # clientes por segundo en esa hora
+        if tasa <= 0:
+            continue
+        t = hora * 3600 + rng.expovariate(tasa)
+        while t < (hora + 1) * 3600:
+            llegadas.append(t)
+            t += rng.expovariate(tasa)
+    return llegadas
+
+
+def tamano_canasta(media, maximo, rng):
+    # Geométrica desplazada: la mayoría compra pocos artículos y unos pocos llenan el carrito
+    if media <= 1:
+        return 1
+    return min(maximo, 1 + int(rng.expovariate(1 / (media - 1))))
+
+
+class Popularidad:
+    """Elige productos con distribución tipo Zipf (pocos productos concentran la mayoría de las ventas)."""
+
+    def __init__(self, ids, exponente, rng):
+        self.ids = ids
+        self.rng = rng
+        acumulado = 0.0
+        self.acumulados = []
+        for rango in range(1, len(ids) + 1):
+            acumulado += 1 / rango ** exponente
+            self.acumulados.append(acumulado)
+
+    def elegir(self):
+        return self.ids[bisect.bisect(self.acumulados, self.rng.random() * self.acumulados[-1])]
+
+
+# ====================================================================
+#           MEDICIÓN
+# ====================================================================
+
+def tamano_base(cursor):
+    # Tamaño lógico (páginas usadas): no depende de cuándo se hizo el último checkpoint del WAL
+    cursor.execute("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()")
+    return cursor.fetchone()[0]
+
+
+class Latencias:
+    def __init__(self):
+        self.muestras = {}
+
+    def medir(self, operacion, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        self.anotar(operacion, (time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    def anotar(self, operacion, ms):
+        self.muestras.setdefault(operacion, []).append(ms)
+
+    def percentil(self, operacion, p):
+        datos = sorted(self.muestras[operacion])
+        return datos[min(len(datos) - 1, int(len(datos) * p / 100))]
+
+    def informe(self):
+        lineas = []
+        for operacion, datos in sorted(self.muestras.items()):
+            lineas.append(f"\n{operacion}: {len(datos)} ops, media {sum(datos) / len(datos):.2f} ms, "
+                          f"p50 {self.percentil(operacion, 50):.2f} ms, p95 {self.percentil(operacion, 95):.2f} ms, "
+                          f"p99 {self.percentil(operacion, 99):.2f} ms, máx {max(datos):.2f} ms")
+            conteos = [0] * len(LIMITES_HISTOGRAMA_MS)
+            for valor in datos:
+                conteos[bisect.bisect_left(LIMITES_HISTOGRAMA_MS, valor)] += 1
+            mayor = max(conteos)
+            anterior = 0
+            for limite, conteo in zip(LIMITES_HISTOGRAMA_MS, conteos):
+                etiqueta = f"{anterior:>5g}-{limite:<5g}ms" if limite != math.inf else f"{anterior:>5g}+     ms"
+                barra = "#" * max(1 if conteo else 0, round(40 * conteo / mayor))
+                lineas.append(f"  {etiqueta} {conteo:>7} {barra}")
+                anterior = limite
+        return "\n".join(lineas)
+
+
+# ====================================================================
+#           OPERACIONES SIMULADAS
+# ====================================================================
+
+def venta(repo, popularidad, canasta, caja_id, rng):
+    """Escanea la canasta como add_to_carrito y la confirma como finalizar_venta. Devuelve el id de venta."""
+    carrito = Carrito()
+    for _ in range(canasta):
+        producto = repo.productos.buscar_para_venta(str(popularidad.elegir()))
+        cantidad = rng.choices([1, 2, 3, 6], weights=[75, 17, 6, 2])[0]
+        prod_id, nombre, stock_actual, precio = producto
+        if cantidad + carrito.cantidad_de(prod_id) > stock_actual:
+            continue  # Stock insuficiente: el cajero no lo agrega
+        carrito.agregar(prod_id, nombre, precio, cantidad)
+
+    if not carrito:
+        return None
+    venta_id, _ = registrar_venta(repo, carrito, caja_id)
+    repo.commit()
+    return venta_id
+
+
+def devolucion(repo, venta_id, caja_id):
+    registrar_devolucion(repo, venta_id, caja_id)
+    repo.commit()
+
+
+def recepcion(repo, producto_id, cantidad):
+    recibir_mercancia(repo, producto_id, cantidad)
+    repo.commit()
+
+
+def busqueda(repo, fts_ventas, rng):
+    # Mitad búsqueda de inventario (cargar_productos), mitad búsqueda en el historial (buscar_ventas)
+    if rng.random() < 0.5:
+        return repo.productos.pagina(f"{rng.randint(0, 99):02d}", "Nombre", False, 0, 201)
+    return repo.ventas.buscar(fts_ventas, f"Producto {rng.randint(0, 99):02d}")
+
+
+# ====================================================================
+#           SIMULACIÓN DEL DÍA
+# ====================================================================
+
+def simular_dia(args):
+    rng = random.Random(args.semilla)
+    conn = conectar(args.db, cached_statements=SENTENCIAS_EN_CACHE)
+    repo = Repositorio(conn)
+    cursor = conn.cursor()  # Solo para medir el tamaño de la base
+    fts_ventas = crear_esquema(repo)
+    sembrar_catalogo(repo, args.productos, rng)
+    caja_id = abrir_caja(repo)
+    repo.commit()
+
+    popularidad = Popularidad(repo.productos.ids(), args.zipf, rng)
+    latencias = Latencias()
+
+    # Respaldos en línea durante el día: las ventas se separan según haya o no una copia en curso
+    gestor = None
+    latencias_respaldo = Latencias()
+    proximo_respaldo = math.inf
+    respaldos_previos = set()
+    if args.respaldo > 0:
+        # Sin respaldos programados por reloj (intervalo de un día real) ni rotación: solo los pedidos aquí
+        gestor = GestorRespaldos(args.db, args.respaldo_destino, intervalo_min=24 * 60, conservar=0)
+        respaldos_previos = set(listar_respaldos(args.respaldo_destino))
+        gestor.iniciar()
+        proximo_respaldo = args.respaldo * 60
+    respaldos_pedidos = 0
+    ventas_hechas = []
+
+    llegadas = llegadas_del_dia(args.ventas_dia, args.perfil, rng)
+    crecimiento = [(0, tamano_base(cursor))]
+    hora_actual = 0
+    inicio = time.perf_counter()
+
+    print(f"Simulando {len(llegadas)} clientes en {len(args.perfil)} horas sobre {args.db} ...")
+    for llegada in llegadas:
+        # Con --velocidad > 0 se respeta el reloj simulado (comprimido); con 0 se va lo más rápido posible
+        if args.velocidad > 0:
+            espera = llegada / args.velocidad - (time.perf_counter() - inicio)
+            if espera > 0:
+                time.sleep(espera)
+
+        while llegada >= (hora_actual + 1) * 3600:
+            hora_actual += 1
+            crecimiento.append((hora_actual, tamano_base(cursor)))
+
+        if llegada >= proximo_respaldo:
+            gestor.solicitar()
+            respaldos_pedidos += 1
+            proximo_respaldo += args.respaldo * 60
+
+        canasta = tamano_canasta(args.canasta_media, args.canasta_max, rng)
+        con_respaldo = gestor is not None and gestor.en_curso
+        venta_id = latencias.medir("venta", venta, repo, popularidad, canasta, caja_id, rng)
+        if gestor:
+            con_respaldo = con_respaldo or gestor.en_curso
+            latencias_respaldo.anotar("venta con respaldo en curso" if con_respaldo else "venta sin respaldo",
+                                      latencias.muestras["venta"][-1])
+        if venta_id:
+            ventas_hechas.append(venta_id)
+
+        if ventas_hechas and rng.random() < args.prob_devolucion:
+            venta_devuelta = ventas_hechas.pop(rng.randrange(len(ventas_hechas)))
+            latencias.medir("devolucion", devolucion, repo, venta_devuelta, caja_id)
+        if rng.random() < args.prob_recepcion:
+            latencias.medir("recepcion", recepcion, repo, popularidad.elegir(), rng.randint(12, 240))
+        if rng.random() < args.prob_busqueda:
+            latencias.medir("busqueda", busqueda, repo, fts_ventas, rng)
+
+    duracion = time.perf_counter() - inicio
+    for hora in range(hora_actual + 1, len(args.perfil) + 1):
+        crecimiento.append((hora, tamano_base(cursor)))
+
+    cerrar_caja(repo, caja_id, repo.cajas.obtener(caja_id).ganancia_total)
+    repo.commit()
+    conn.close()
+
+    imprimir_informe(args, latencias, crecimiento, duracion)
+    if gestor:
+        gestor.detener(timeout=None)  # Espera a que termine la copia en curso
+        archivos = [ruta for ruta in listar_respaldos(args.respaldo_destino) if ruta not in respaldos_previos]
+        imprimir_informe_respaldos(args, latencias_respaldo, respaldos_pedidos, gestor.respaldos_hechos, archivos)
+    print("\nTiempos por sentencia (repositorio):")
+    for linea in repo.resumen_tiempos():
+        print(f"  {linea}")
+
+
+def imprimir_informe(args, latencias, crecimiento, duracion):
+    print(latencias.informe())
+
+    total_ops = sum(len(datos) for datos in latencias.muestras.values())
+    ventas = latencias.muestras.get("venta", [])
+    print(f"\nDuración real: {duracion:.1f} s, {total_ops} operaciones ({total_ops / duracion:.0f} ops/s)")
+    if ventas:
+        # Capacidad de una caja: ventas por minuto si la PC solo hiciera finalizar_venta, una tras otra
+        capacidad = 60000 / (sum(ventas) / len(ventas))
+        p99 = latencias.percentil("venta", 99)
+        aviso = "OK" if p99 < UMBRAL_LATENCIA_MS else "LATENCIA PERCEPTIBLE"
+        print(f"Capacidad estimada de la caja: {capacidad:.0f} ventas/min "
+              f"(p99 de venta {p99:.1f} ms, umbral {UMBRAL_LATENCIA_MS} ms: {aviso})")
+        pico = max(args.perfil) / sum(args.perfil) * args.ventas_dia / 60
+        print(f"Ventas por minuto en la hora pico del perfil: {pico:.1f}")
+
+    print("\nCrecimiento de la base de datos por hora simulada:")
+    anterior = crecimiento[0][1]
+    for hora, tamano in crecimiento:
+        print(f"  {HORA_APERTURA + hora:02d}:00  {tamano / 1024:>10.0f} KiB  (+{(tamano - anterior) / 1024:.0f} KiB)")
+        anterior = tamano
+
+
+def imprimir_informe_respaldos(args, latencias, pedidos, hechos, archivos):
+    # Las solicitudes que llegan con una copia en curso se juntan en un solo respaldo (hechos <= pedidos);
+    # cada respaldo hecho tiene que haber dejado su archivo
+    aviso = "" if hechos == len(archivos) else "  FALTAN ARCHIVOS"
+    print(f"\nRespaldos en {args.respaldo_destino}: {pedidos} pedidos, {hechos} hechos, "
+          f"{len(archivos)} archivos{aviso}")
+    for ruta in archivos:
+        estado = "OK" if verificar_respaldo(ruta) else "RESPALDO INVÁLIDO"
+        print(f"  {os.path.basename(ruta)}  {os.path.getsize(ruta) / 1024:>8.0f} KiB  {estado}")
+
+    print(latencias.informe())
+    if all(operacion in latencias.muestras for operacion in ("venta con respaldo en curso", "venta sin respaldo")):
+        con = latencias.percentil("venta con respaldo en curso", 99)
+        sin = latencias.percentil("venta sin respaldo", 99)
+        aviso = "OK" if con < UMBRAL_LATENCIA_MS else "LATENCIA PERCEPTIBLE"
+        print(f"\np99 de venta: {sin:.1f} ms sin respaldo, {con:.1f} ms con respaldo en curso "
+              f"(umbral {UMBRAL_LATENCIA_MS} ms: {aviso})")
+    else:
+        print("\nNinguna venta coincidió con un respaldo en curso; pruebe con --velocidad o un --respaldo menor.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simula un día de ventas contra una base de datos del POS.")
+    parser.add_argument("--db", default="carga_pos.db", help="Base de datos a usar (no usar la de producción)")
+    parser.add_argument("--productos", type=int, default=2000, help="Tamaño del catálogo de prueba")
+    parser.add_argument("--ventas-dia", type=int, default=3000, help="Clientes esperados en el día")
+    parser.add_argument("--perfil", type=lambda s: [float(x) for x in s.split(",")], default=PERFIL_DIA,
+                        help="Pesos de llegada por hora desde la apertura, separados por coma")
+    parser.add_argument("--canasta-media", type=float, default=4, help="Artículos distintos por venta (media)")
+    parser.add_argument("--canasta-max", type=int, default=60, help="Máximo de artículos distintos por venta")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Exponente de popularidad de productos")
+    parser.add_argument("--prob-devolucion", type=float, default=0.01, help="Probabilidad de devolución por cliente")
+    parser.add_argument("--prob-recepcion", type=float, default=0.02, help="Probabilidad de recepción por cliente")
+    parser.add_argument("--prob-busqueda", type=float, default=0.2, help="Probabilidad de búsqueda por cliente")
+    parser.add_argument("--velocidad", type=float, default=0,
+                        help="Factor de compresión del reloj simulado (p. ej. 60 = una hora por minuto; 0 = sin pausas)")
+    parser.add_argument("--semilla", type=int, default=None, help="Semilla para repetir la misma simulación")
+    parser.add_argument("--respaldo", type=float, default=0,
+                        help="Pide un respaldo en línea cada N minutos simulados (0 = sin respaldos)")
+    parser.add_argument("--respaldo-destino", default=None,
+                        help="Carpeta de los respaldos de la prueba (por defecto <db>_respaldos)")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.db) == os.path.abspath("pos_data.db"):
+        parser.error("No uses la base de datos de producción para la prueba de carga.")
+    if args.respaldo_destino is None:
+        args.respaldo_destino = os.path.splitext(args.db)[0] + "_respaldos"
+    simular_dia(args)
@@ -0,0 +1,158 @@
+"""Perfil de conexión y mantenimiento periódico de la base de datos del POS.
+
+conectar() abre las conexiones con un perfil ajustado para una caja (WAL,
+synchronous NORMAL, caché y mmap más grandes, temporales en memoria).
+
+GestorMantenimiento ejecuta PRAGMA optimize, ANALYZE, vacuum incremental y
+checkpoint del WAL desde un hilo en segundo plano, y registra en el log el
+tamaño del archivo y el tiempo de unas consultas de referencia antes y
+después, para poder medir el efecto. El VACUUM completo que activa el vacuum
+incremental (una sola vez) bloquea las escrituras mientras reescribe la base:
+solo se hace desde la línea de comandos, con el POS cerrado.
+
+Uso manual:
+    python mantenimiento.py --db pos_data.db --completo
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA -> valor. cache_size negativo = KiB (aquí 32 MiB); mmap_size en bytes (256 MiB)
+PERFIL_CONEXION = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -32000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+# Páginas libres que devuelve al sistema cada vacuum incremental
+PAGINAS_VACUUM_INCREMENTAL = 2000
+
+# Consultas que se cronometran antes y después del mantenimiento
+CONSULTAS_REFERENCIA = {
+    "ventas_ultimos_30_dias": "SELECT COUNT(*), SUM(total) FROM ventas WHERE fecha >= date('now', '-30 day')",
+    "productos_por_nombre": "SELECT id, nombre FROM productos ORDER BY nombre COLLATE NOCASE LIMIT 200",
+    "productos_bajo_stock": "SELECT COUNT(*) FROM productos WHERE stock < 5",
+    "caja_abierta": "SELECT id FROM caja WHERE estado='Abierta' ORDER BY id DESC LIMIT 1",
+}
+
+
+def aplicar_perfil(conn, perfil=PERFIL_CONEXION):
+    for pragma, valor in perfil.items():
+        conn.execute(f"PRAGMA {pragma}={valor}")
+    return conn
+
+
+def conectar(db_path, **kwargs):
+    """sqlite3.connect con el perfil de conexión del POS aplicado.
+
+    Si se pasa timeout= (segundos) se respeta cuando es mayor que el busy_timeout del perfil.
+    """
+    perfil = dict(PERFIL_CONEXION)
+    if "timeout" in kwargs:
+        perfil["busy_timeout"] = max(perfil["busy_timeout"], int(kwargs["timeout"] * 1000))
+    return aplicar_perfil(sqlite3.connect(db_path, **kwargs), perfil)
+
+
+def tamano_archivos(db_path):
+    """Bytes ocupados por la base de datos más su WAL."""
+    return sum(os.path.getsize(ruta) for ruta in (db_path, db_path + "-wal") if os.path.exists(ruta))
+
+
+def medir_consultas(conn):
+    tiempos = {}
+    for nombre, sql in CONSULTAS_REFERENCIA.items():
+        inicio = time.perf_counter()
+        try:
+            conn.execute(sql).fetchall()
+        except sqlite3.OperationalError:
+            continue  # Tabla aún no creada
+        tiempos[nombre] = (time.perf_counter() - inicio) * 1000
+    return tiempos
+
+
+class GestorMantenimiento:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.ultimo_informe = None
+        self._lock = threading.Lock()
+
+    def ejecutar_en_segundo_plano(self, completo=False):
+        """Lanza el mantenimiento en un hilo; si ya hay uno en curso no hace nada."""
+        if self._lock.locked():
+            return False
+        threading.Thread(target=self._ejecutar_con_log, args=(completo,), name="mantenimiento-pos",
+                         daemon=True).start()
+        return True
+
+    def _ejecutar_con_log(self, completo):
+        try:
+            self.ejecutar(completo)
+        except Exception:
+            logger.exception("Falló el mantenimiento de %s", self.db_path)
+
+    def ejecutar(self, completo=False, activar_auto_vacuum=False):
+        """Mantenimiento ligero (optimize + vacuum incremental + checkpoint) o completo (además ANALYZE).
+        Devuelve un informe con el antes y el después.
+
+        activar_auto_vacuum hace, la primera vez, el VACUUM completo que activa auto_vacuum incremental:
+        reescribe toda la base con el bloqueo de escritura tomado, así que solo desde la línea de comandos,
+        con el POS cerrado.
+        """
+        with self._lock:
+            # isolation_level=None: VACUUM y los PRAGMA no pueden ir dentro de una transacción
+            conn = conectar(self.db_path, timeout=30, isolation_level=None)
+            try:
+                informe = {
+                    "completo": completo,
+                    "bytes_antes": tamano_archivos(self.db_path),
+                    "consultas_antes_ms": medir_consultas(conn),
+                }
+                inicio = time.perf_counter()
+
+                if completo:
+                    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                        if activar_auto_vacuum:
+                            # Cambiar a INCREMENTAL solo tiene efecto tras un VACUUM completo (una única vez)
+                            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                            conn.execute("VACUUM")
+                        else:
+                            logger.info("auto_vacuum incremental sin activar en %s: ejecutar "
+                                        "'python mantenimiento.py --completo' con el POS cerrado", self.db_path)
+                    conn.execute("ANALYZE")
+                conn.execute("PRAGMA optimize")
+                conn.execute(f"PRAGMA incremental_vacuum({PAGINAS_VACUUM_INCREMENTAL})")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+                informe["segundos"] = time.perf_counter() - inicio
+                informe["bytes_despues"] = tamano_archivos(self.db_path)
+                informe["consultas_despues_ms"] = medir_consultas(conn)
+            finally:
+                conn.close()
+
+            self.ultimo_informe = informe
+            logger.info("Mantenimiento %s en %.2f s: %d -> %d bytes",
+                        "completo" if completo else "ligero", informe["segundos"], informe["bytes_antes"],
+                        informe["bytes_despues"])
+            for nombre, antes in informe["consultas_antes_ms"].items():
+                logger.info("  %s: %.2f ms -> %.2f ms", nombre, antes, informe["consultas_despues_ms"].get(nombre, 0))
+            return informe
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos del POS.")
+    parser.add_argument("--db", default="pos_data.db", help="Base de datos del POS")
+    parser.add_argument("--completo", action="store_true",
+                        help="Incluye ANALYZE y activa el vacuum incremental (con el POS cerrado)")
+    args = parser.parse_args()
+
+    GestorMantenimiento(args.db).ejecutar(args.completo, activar_auto_vacuum=args.completo)
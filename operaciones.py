@@ -0,0 +1,319 @@
+"""Lógica del POS sin interfaz gráfica: esquema, ventas, devoluciones, stock y caja.
+
+POSApp y RecepcionMercanciaWindow llaman a estas funciones desde sus botones;
+generador_carga.py las usa directamente, sin pantalla. El SQL de cada paso
+está en repositorio.py; aquí se arman las operaciones completas. Ninguna
+función hace commit: quien llama confirma la transacción completa (o hace
+rollback).
+"""
+import datetime
+import sqlite3
+
+from carrito import formatear_centavos
+
+# Días máximos entre instantáneas de stock (además de la que se toma al cerrar caja)
+SNAPSHOT_STOCK_DIAS = 1
+
+# Tablas cuyos cambios quedan en el registro 'cambios' (ver sincronizacion.py) -> columnas replicadas
+TABLAS_CAMBIOS = {
+    "productos": ("id", "nombre", "categoria", "descripcion", "stock", "precio"),
+    "ventas": ("id", "fecha", "total", "detalles", "es_devolucion", "fecha_devolucion"),
+    "caja": ("id", "estado", "fecha_apertura", "fecha_cierre", "ganancia_total"),
+}
+
+
+def ahora():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ====================================================================
+#           ESQUEMA DE LA BASE DE DATOS
+# ====================================================================
+
+def crear_esquema(repo):
+    """Crea o actualiza tablas, índices y triggers. Devuelve True si la búsqueda de ventas usa FTS5."""
+    # DDL de una sola vez al abrir la base: va directo por el cursor, fuera de la medición del repositorio
+    cursor = repo.cursor
+    # Tabla de Productos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS productos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            categoria TEXT,
+            descripcion TEXT,
+            stock INTEGER NOT NULL,
+            precio REAL NOT NULL
+        )
+    ''')
+
+    # Tabla de Ventas (Se añade columna para marcar si es una devolución)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TEXT NOT NULL,
+            total REAL NOT NULL,
+            detalles TEXT NOT NULL,
+            es_devolucion INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Tabla de Control de Caja
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caja (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            estado TEXT NOT NULL,
+            fecha_apertura TEXT NOT NULL,
+            fecha_cierre TEXT,
+            ganancia_total REAL
+        )
+    ''')
+
+    # Fecha en que se devolvió la venta (permite exportar solo las devoluciones nuevas)
+    cursor.execute("PRAGMA table_info(ventas)")
+    if "fecha_devolucion" not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE ventas ADD COLUMN fecha_devolucion TEXT")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ventas_fecha_devolucion ON ventas (fecha_devolucion) "
+        "WHERE fecha_devolucion IS NOT NULL")
+
+    # Marcas de agua de la exportación incremental (una por formato)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exportaciones (
+            formato TEXT PRIMARY KEY,
+            ultimo_id INTEGER NOT NULL,
+            ultima_devolucion TEXT NOT NULL DEFAULT '',
+            archivo TEXT,
+            fecha TEXT NOT NULL
+        )
+    ''')
+    # Devoluciones del segundo de la marca ya exportadas (la marca tiene resolución de un segundo)
+    cursor.execute("PRAGMA table_info(exportaciones)")
+    if "devoluciones_en_marca" not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE exportaciones ADD COLUMN devoluciones_en_marca TEXT NOT NULL DEFAULT ''")
+
+    # Libro de movimientos de stock (solo se agregan filas) e instantáneas periódicas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS movimientos_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            referencia TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_producto ON movimientos_stock (producto_id, fecha)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TEXT NOT NULL,
+            ultimo_movimiento_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_fecha ON snapshots_stock (fecha)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_stock_detalle (
+            snapshot_id INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, producto_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Búsqueda en el historial de ventas: índice FTS5 sobre los detalles y filtros indexados por fecha/total
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_total ON ventas (total)")
+    fts_ventas = crear_fts_ventas(cursor)
+
+    # Registro de cambios para sincronizar con la oficina central sin comparar tablas completas
+    crear_registro_cambios(cursor)
+
+    # Índices para ordenar el inventario por columna sin recorrer toda la tabla
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos (nombre COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_categoria ON productos (categoria COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_stock ON productos (stock)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_precio ON productos (precio)")
+
+    # Instantánea inicial y periódica para que las consultas de stock a fecha sean cortas
+    limite = (datetime.datetime.now() - datetime.timedelta(days=SNAPSHOT_STOCK_DIAS)).strftime("%Y-%m-%d %H:%M:%S")
+    if not repo.stock.hay_snapshot_desde(limite):
+        tomar_snapshot_stock(repo)
+
+    return fts_ventas
+
+
+def crear_fts_ventas(cursor):
+    """Crea el índice FTS5 de ventas (tabla de contenido externo + triggers). Devuelve False si
+    el SQLite instalado no trae FTS5; en ese caso la búsqueda usa LIKE."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='ventas_fts'")
+    existia = cursor.fetchone() is not None
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ventas_fts USING fts5(
+                detalles, content='ventas', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        return False
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ventas_fts_ai AFTER INSERT ON ventas BEGIN
+            INSERT INTO ventas_fts (rowid, detalles) VALUES (new.id, new.detalles);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ventas_fts_ad AFTER DELETE ON ventas BEGIN
+            INSERT INTO ventas_fts (ventas_fts, rowid, detalles) VALUES ('delete', old.id, old.detalles);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ventas_fts_au AFTER UPDATE OF detalles ON ventas BEGIN
+            INSERT INTO ventas_fts (ventas_fts, rowid, detalles) VALUES ('delete', old.id, old.detalles);
+            INSERT INTO ventas_fts (rowid, detalles) VALUES (new.id, new.detalles);
+        END
+    ''')
+
+    if not existia:
+        # Indexa el historial que ya existía antes de crear la tabla FTS
+        cursor.execute("INSERT INTO ventas_fts (ventas_fts) VALUES ('rebuild')")
+    return True
+
+
+def crear_registro_cambios(cursor):
+    """Crea la tabla 'cambios' y sus triggers. Cada alta, modificación o baja en TABLAS_CAMBIOS
+    agrega una fila con número de secuencia creciente (AUTOINCREMENT nunca reutiliza valores)."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='cambios'")
+    existia = cursor.fetchone() is not None
+    # Solo la clave y la operación: el estado de la fila se lee al exportar
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla TEXT NOT NULL,
+            fila_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL,
+            fecha TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+        )
+    ''')
+    for tabla in TABLAS_CAMBIOS:
+        for evento, operacion, fila in (("INSERT", "I", "new"), ("UPDATE", "U", "new"), ("DELETE", "D", "old")):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {tabla}_cambios_{operacion.lower()} AFTER {evento} ON {tabla} BEGIN
+                    INSERT INTO cambios (tabla, fila_id, operacion) VALUES ('{tabla}', {fila}.id, '{operacion}');
+                END
+            ''')
+
+    if not existia:
+        # Las filas que ya existían entran como altas, así el primer envío es la copia completa
+        for tabla in TABLAS_CAMBIOS:
+            cursor.execute(f"INSERT INTO cambios (tabla, fila_id, operacion) SELECT '{tabla}', id, 'I' FROM {tabla}")
+
+
+# ====================================================================
+#           INSTANTÁNEAS DE STOCK Y CAJA
+# ====================================================================
+
+def tomar_snapshot_stock(repo):
+    return repo.stock.tomar_snapshot(ahora())
+
+
+def abrir_caja(repo):
+    """Abre una caja nueva con ganancia 0. Devuelve su id."""
+    return repo.cajas.abrir(ahora())
+
+
+def cerrar_caja(repo, caja_id, ganancia_total):
+    """Cierra la caja y toma la instantánea de stock del cierre."""
+    repo.cajas.cerrar(caja_id, ahora(), ganancia_total)
+    tomar_snapshot_stock(repo)
+
+
+# ====================================================================
+#           PRODUCTOS Y RECEPCIÓN DE MERCANCÍA
+# ====================================================================
+
+def alta_producto(repo, nombre, categoria, descripcion, stock, precio):
+    """Crea el producto y anota su stock inicial en el libro de movimientos. Devuelve su id."""
+    producto_id = repo.productos.insertar(nombre, categoria, descripcion, stock, precio)
+    repo.stock.registrar_movimiento(producto_id, stock, 'alta', ahora())
+    return producto_id
+
+
+def recibir_mercancia(repo, producto_id, cantidad):
+    if cantidad <= 0:
+        raise ValueError("La cantidad debe ser un número entero positivo.")
+    # Actualiza el stock sumando la cantidad recibida
+    repo.productos.sumar_stock(producto_id, cantidad)
+    repo.stock.registrar_movimiento(producto_id, cantidad, 'recepcion', ahora())
+
+
+# ====================================================================
+#           VENTAS Y DEVOLUCIONES
+# ====================================================================
+
+def registrar_venta(repo, carrito, caja_id):
+    """Descuenta stock, guarda la venta y suma el total a la caja. Devuelve (venta_id, total)."""
+    # El total sale del modelo del carrito (centavos exactos)
+    total_venta = carrito.total_centavos / 100
+    fecha = ahora()
+    detalles_venta = []
+
+    for linea in carrito:
+        repo.productos.sumar_stock(linea.producto_id, -linea.cantidad)
+        # CAMBIO 13: Reemplazar $ por C$ en los detalles que se guardan
+        detalles_venta.append(f"{linea.nombre} ({linea.cantidad} x {formatear_centavos(linea.precio_centavos)})")
+
+    venta_id = repo.ventas.insertar(fecha, total_venta, " | ".join(detalles_venta))
+
+    # Salidas de stock en el libro de movimientos, en la misma transacción que la venta
+    for linea in carrito:
+        repo.stock.registrar_movimiento(linea.producto_id, -linea.cantidad, 'venta', fecha, venta_id)
+
+    repo.cajas.sumar_ganancia(caja_id, total_venta)
+    return venta_id, total_venta
+
+
+def parsear_detalles(detalles):
+    """Separa el texto de detalles de una venta en (nombre, cantidad, precio en texto) por línea."""
+    lineas = []
+    for item in detalles.split(' | '):
+        # Ejemplo: 'Producto A (2 x C$10.00)'
+        nombre, _, cantidad_precio = item.rpartition(' (')
+        cantidad, _, precio = cantidad_precio.rstrip(')').partition(' x ')
+        lineas.append((nombre.strip(), int(cantidad), precio))
+    return lineas
+
+
+def registrar_devolucion(repo, venta_id, caja_id=None):
+    """Repone el stock de la venta, la marca como devuelta y resta su total de la caja abierta.
+
+    Devuelve (total_devuelto, nombres de productos cuyo stock no se pudo reponer).
+    """
+    venta = repo.ventas.obtener(venta_id)
+    if venta is None:
+        raise ValueError(f"La venta ID {venta_id} no existe.")
+    if venta.es_devolucion:
+        raise ValueError("Esta venta ya ha sido devuelta.")
+
+    fecha = ahora()
+    no_repuestos = []
+    # 1. Analizar los detalles para reponer el stock
+    for nombre, cantidad, _ in parsear_detalles(venta.detalles):
+        # Buscamos el ID del producto por nombre (o ajustamos la lógica si se usaran códigos)
+        producto_id = repo.productos.id_por_nombre(nombre)
+
+        if producto_id:
+            # Reponer stock
+            repo.productos.sumar_stock(producto_id, cantidad)
+            repo.stock.registrar_movimiento(producto_id, cantidad, 'devolucion', fecha, venta_id)
+        else:
+            # No hacemos un 'continue', intentamos seguir con la transacción
+            no_repuestos.append(nombre)
+
+    # 2. Marcar la venta como devolución en la BD
+    repo.ventas.marcar_devolucion(venta_id, fecha)
+
+    # 3. Ajustar la ganancia de la caja (asumiendo que total es ganancia bruta en este sistema)
+    if caja_id is not None:
+        repo.cajas.sumar_ganancia(caja_id, -venta.total)
+
+    return venta.total, no_repuestos
@@ -1,7 +1,19 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-import sqlite3
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import datetime
+import logging
+import multiprocessing
+import os
+import time
+
+from carrito import Carrito, formatear_centavos
+from mantenimiento import GestorMantenimiento, conectar
+from operaciones import (abrir_caja, alta_producto, cerrar_caja, crear_esquema, recibir_mercancia,
+                         registrar_devolucion, registrar_venta)
+from recibos import ColaRecibos
+from repositorio import (LIMITE_BUSQUEDA_VENTAS, ORDEN_PRODUCTOS, SENTENCIAS_EN_CACHE, Repositorio,
+                         siguiente_marca_exportacion)
+from respaldo import GestorRespaldos
 
 try:
     from ttkbootstrap import Style
@@ -12,22 +24,41 @@ except ImportError:
 
 try:
     import pandas as pd
-    from reportlab.lib.pagesizes import letter
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.lib import colors
+    from openpyxl import load_workbook
+    from exportacion import EjecutorExportaciones, generar_pdf_ventas
 
     EXPORT_AVAILABLE = True
 except ImportError:
     EXPORT_AVAILABLE = False
     print("ADVERTENCIA: Las funciones de exportación (Excel/PDF) no estarán disponibles sin 'pandas' y 'reportlab'.")
 
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'pos_data.db'
+
+# Respaldos automáticos de la base de datos (ver respaldo.py)
+RESPALDOS_DIR = 'respaldos'
+RESPALDOS_INTERVALO_MIN = 60
+RESPALDOS_CONSERVAR = 14
+
+# Mantenimiento de la base de datos en reposo (ver mantenimiento.py)
+MANTENIMIENTO_REPOSO_MIN = 15
+MANTENIMIENTO_REVISION_MS = 60 * 1000
+
+# Filas que se cargan por página en el Treeview de productos
+PAGINA_PRODUCTOS = 200
+
+# Recibos (ver recibos.py): con RECIBOS_DISPOSITIVO (p. ej. '/dev/usb/lp0' o 'LPT1') los bytes ESC/POS
+# van directo a la impresora; si es None se dejan en la carpeta de spool RECIBOS_DIR.
+RECIBOS_DIR = 'recibos'
+RECIBOS_DISPOSITIVO = None
+RECIBOS_FORMATOS = ('escpos',)
+RECIBOS_ANCHO_MM = 80
 
 class RecepcionMercanciaWindow:
-    def __init__(self, master, conn, refresh_callback):
+    def __init__(self, master, repo, refresh_callback):
         self.master = master
-        self.conn = conn
-        self.cursor = self.conn.cursor()
+        self.repo = repo
         self.refresh_callback = refresh_callback  # Para actualizar el Treeview principal
 
         top = tk.Toplevel(master)
@@ -76,17 +107,13 @@ class RecepcionMercanciaWindow:
             messagebox.showwarning("Advertencia", "Ingresa un ID o nombre para buscar.")
             return
 
-        query = "SELECT id, nombre, stock FROM productos WHERE id=? OR nombre LIKE ?"
-        self.cursor.execute(query, (search_term, f'%{search_term}%'))
-        producto = self.cursor.fetchone()
+        producto = self.repo.productos.buscar_para_venta(search_term)
 
         if producto:
-            self.producto_id = producto[0]
-            nombre = producto[1]
-            stock = producto[2]
+            self.producto_id = producto.id
 
-            self.nombre_label.config(text=f"Nombre: {nombre}")
-            self.stock_label.config(text=f"Stock Actual: {stock}")
+            self.nombre_label.config(text=f"Nombre: {producto.nombre}")
+            self.stock_label.config(text=f"Stock Actual: {producto.stock}")
             self.btn_recibir.config(state=NORMAL)
         else:
             self.producto_id = None
@@ -109,9 +136,8 @@ class RecepcionMercanciaWindow:
             return
 
         try:
-            # Actualiza el stock sumando la cantidad recibida
-            self.cursor.execute("UPDATE productos SET stock = stock + ? WHERE id=?", (cantidad, self.producto_id))
-            self.conn.commit()
+            recibir_mercancia(self.repo, self.producto_id, cantidad)
+            self.repo.commit()
 
             # Recarga la información de la ventana local y la principal
             self.buscar_producto()
@@ -122,6 +148,8 @@ class RecepcionMercanciaWindow:
             self.cantidad_entry.delete(0, tk.END)
 
         except Exception as e:
+            # El UPDATE y el movimiento del libro van juntos: no se deja nada a medias en la conexión
+            self.repo.rollback()
             messagebox.showerror("Error de BD", f"Ocurrió un error al actualizar el stock: {e}")
 
 
@@ -141,15 +169,43 @@ class POSApp:
         self.style.configure("Treeview.Heading", font=("Segoe UI", 10, "bold"))
 
         # 2. Inicializar la Base de Datos
-        self.conn = sqlite3.connect('pos_data.db')
-        self.cursor = self.conn.cursor()
+        self.conn = conectar(DB_PATH, cached_statements=SENTENCIAS_EN_CACHE)  # WAL, caché, mmap, etc.
+        # Todo el SQL de la ventana pasa por el repositorio (sentencias parametrizadas, tiempos y reintentos)
+        self.repo = Repositorio(self.conn)
         self.setup_database()
 
+        # Respaldos en línea desde un hilo en segundo plano (no detienen las ventas)
+        self.gestor_respaldos = GestorRespaldos(DB_PATH, RESPALDOS_DIR, intervalo_min=RESPALDOS_INTERVALO_MIN,
+                                                conservar=RESPALDOS_CONSERVAR)
+        self.gestor_respaldos.iniciar()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_cerrar)
+
+        # Mantenimiento (optimize, analyze, vacuum, checkpoint) en reposo y al cerrar caja
+        self.gestor_mantenimiento = GestorMantenimiento(DB_PATH)
+        self.ultima_actividad = time.monotonic()
+        self.mantenimiento_en_reposo_hecho = False
+        self.root.bind_all('<Any-KeyPress>', self.registrar_actividad, add='+')
+        self.root.bind_all('<Any-ButtonPress>', self.registrar_actividad, add='+')
+        self.root.after(MANTENIMIENTO_REVISION_MS, self.revisar_mantenimiento)
+
+        # Trabajos de exportación por período en procesos aparte (ver exportacion.py)
+        self.ejecutor_exportaciones = EjecutorExportaciones(DB_PATH) if EXPORT_AVAILABLE else None
+
+        # Recibos renderizados e impresos en segundo plano; la caja no espera a la impresora
+        self.cola_recibos = ColaRecibos(RECIBOS_DIR, RECIBOS_DISPOSITIVO, RECIBOS_FORMATOS, RECIBOS_ANCHO_MM)
+        self.cola_recibos.iniciar()
+
         # 3. Variables de la Aplicación
         self.caja_abierta = False
-        self.productos_carrito = {}
+        self.carrito = Carrito()  # Única fuente del total de la venta (en centavos)
         self.ganancia_caja_actual = 0.0
         self.current_caja_id = None
+        self.orden_productos = ("ID", False)  # (columna, descendente)
+        self.productos_busqueda = ""
+        self.productos_offset = 0
+        self.productos_hay_mas = False
+        self.productos_cargando = False
+        self.ventas_filtradas = False  # El historial muestra un resultado de búsqueda, no las últimas ventas
 
         # 4. Crear la Interfaz de Usuario
         self.create_widgets()
@@ -167,40 +223,9 @@ class POSApp:
     # ====================================================================
 
     def setup_database(self):
-        # Tabla de Productos
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS productos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre TEXT NOT NULL,
-                categoria TEXT,
-                descripcion TEXT,
-                stock INTEGER NOT NULL,
-                precio REAL NOT NULL
-            )
-        ''')
-
-        # Tabla de Ventas (Se añade columna para marcar si es una devolución)
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ventas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                fecha TEXT NOT NULL,
-                total REAL NOT NULL,
-                detalles TEXT NOT NULL,
-                es_devolucion INTEGER DEFAULT 0
-            )
-        ''')
-
-        # Tabla de Control de Caja
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS caja (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                estado TEXT NOT NULL,
-                fecha_apertura TEXT NOT NULL,
-                fecha_cierre TEXT,
-                ganancia_total REAL
-            )
-        ''')
-        self.conn.commit()
+        # Tablas, índices y triggers (ver operaciones.crear_esquema)
+        self.fts_ventas = crear_esquema(self.repo)
+        self.repo.commit()
 
     # ====================================================================
     #           SECCIÓN DE WIDGETS Y GUI
@@ -243,21 +268,24 @@ class POSApp:
         # --- NUEVO BOTÓN PARA RECEPCIÓN DE MERCANCÍA ---
         ttk.Button(top_frame, text="📦 Recibir Mercancía", command=self.open_recepcion_mercancia, bootstyle="info").pack(
             side='right', padx=5)
+        ttk.Button(top_frame, text="📅 Stock a Fecha", command=self.open_stock_a_fecha, bootstyle="secondary").pack(
+            side='right', padx=5)
 
         # Treeview de Productos
         columns = ("ID", "Nombre", "Categoría", "Stock", "Precio")
         self.productos_tree = ttk.Treeview(frame, columns=columns, show='headings', height=10, bootstyle="default")
         for col in columns:
-            self.productos_tree.heading(col, text=col)
+            self.productos_tree.heading(col, text=col, command=lambda c=col: self.ordenar_productos(c))
             self.productos_tree.column(col, width=100, anchor='center')
         self.productos_tree.column("ID", width=40)
         self.productos_tree.column("Nombre", width=150)
         self.productos_tree.grid(row=1, column=0, columnspan=3, pady=10, sticky='nsew')
 
-        # Scrollbar para el Treeview
-        vsb = ttk.Scrollbar(frame, orient="vertical", command=self.productos_tree.yview, bootstyle="primary")
-        vsb.grid(row=1, column=3, sticky='ns')
-        self.productos_tree.configure(yscrollcommand=vsb.set)
+        # Scrollbar para el Treeview (al llegar al final se carga la siguiente página)
+        self.productos_vsb = ttk.Scrollbar(frame, orient="vertical", command=self.productos_tree.yview,
+                                           bootstyle="primary")
+        self.productos_vsb.grid(row=1, column=3, sticky='ns')
+        self.productos_tree.configure(yscrollcommand=self.on_scroll_productos)
 
         # Frame de Botones de Producto (CRUD)
         btn_frame = ttk.Frame(frame)
@@ -307,6 +335,15 @@ class POSApp:
         self.carrito_tree.column("Precio Unitario", width=80, anchor='e')
         self.carrito_tree.column("Subtotal", width=80, anchor='e')
         self.carrito_tree.pack(fill='both', expand=True, pady=10)
+        self.carrito_tree.bind('<Double-1>', lambda event: self.editar_cantidad_carrito())
+        self.carrito_tree.bind('<Delete>', lambda event: self.quitar_del_carrito())
+
+        linea_frame = ttk.Frame(frame)
+        linea_frame.pack(fill='x')
+        ttk.Button(linea_frame, text="✏️ Cambiar Cantidad", command=self.editar_cantidad_carrito,
+                   bootstyle="secondary").pack(side='left', fill='x', expand=True, padx=(0, 5))
+        ttk.Button(linea_frame, text="➖ Quitar Producto", command=self.quitar_del_carrito,
+                   bootstyle="secondary").pack(side='left', fill='x', expand=True)
 
         # Total de la Venta
         total_frame = ttk.Frame(frame, padding=5, relief=tk.RIDGE,
@@ -324,6 +361,9 @@ class POSApp:
             fill='x',
             pady=5)
         ttk.Button(frame, text="❌ Vaciar Carrito", command=self.vaciar_carrito, bootstyle="warning").pack(fill='x')
+        # Confirmación de la última venta (sin ventana modal, para pasar directo a la siguiente)
+        self.ultima_venta_label = ttk.Label(frame, text="", bootstyle="success")
+        self.ultima_venta_label.pack(anchor='w', pady=5)
 
     def create_registros_widgets(self, frame):
         notebook = ttk.Notebook(frame, bootstyle="primary")
@@ -333,6 +373,29 @@ class POSApp:
         ventas_frame = ttk.Frame(notebook, padding=5)
         notebook.add(ventas_frame, text="Historial de Ventas")
 
+        # Búsqueda en el historial (texto de los detalles, rango de fechas y total mínimo)
+        busqueda_frame = ttk.Frame(ventas_frame)
+        busqueda_frame.pack(fill='x', pady=(0, 5))
+
+        ttk.Label(busqueda_frame, text="Producto:", bootstyle="info").pack(side='left', padx=(0, 2))
+        self.ventas_texto_entry = ttk.Entry(busqueda_frame, width=18, bootstyle="secondary")
+        self.ventas_texto_entry.pack(side='left', padx=2, fill='x', expand=True)
+        ttk.Label(busqueda_frame, text="Desde:", bootstyle="info").pack(side='left', padx=(5, 2))
+        self.ventas_desde_entry = ttk.Entry(busqueda_frame, width=11, bootstyle="secondary")
+        self.ventas_desde_entry.pack(side='left', padx=2)
+        ttk.Label(busqueda_frame, text="Hasta:", bootstyle="info").pack(side='left', padx=(5, 2))
+        self.ventas_hasta_entry = ttk.Entry(busqueda_frame, width=11, bootstyle="secondary")
+        self.ventas_hasta_entry.pack(side='left', padx=2)
+        ttk.Label(busqueda_frame, text="Total ≥ C$:", bootstyle="info").pack(side='left', padx=(5, 2))
+        self.ventas_total_entry = ttk.Entry(busqueda_frame, width=8, bootstyle="secondary")
+        self.ventas_total_entry.pack(side='left', padx=2)
+
+        ttk.Button(busqueda_frame, text="🔍 Buscar", command=self.buscar_ventas, bootstyle="primary").pack(
+            side='left', padx=5)
+        ttk.Button(busqueda_frame, text="✖ Limpiar", command=self.limpiar_busqueda_ventas,
+                   bootstyle="secondary").pack(side='left')
+        self.ventas_texto_entry.bind('<Return>', lambda event: self.buscar_ventas())
+
         # Treeview de Ventas
         # Columnas actualizadas para mostrar el estado
         columns_ventas = ("ID Venta", "Fecha", "Total", "Detalles", "Estado")
@@ -344,11 +407,15 @@ class POSApp:
         self.ventas_tree.column("Detalles", width=250)
         self.ventas_tree.column("Estado", width=70)
         self.ventas_tree.pack(fill='both', expand=True, pady=(0, 5))
+        # Doble clic sobre una venta (p. ej. un resultado de búsqueda) lleva directo a la devolución
+        self.ventas_tree.bind('<Double-1>', lambda event: self.realizar_devolucion())
 
         # --- NUEVO BOTÓN DE DEVOLUCIÓN ---
         btn_devolucion = ttk.Button(ventas_frame, text="↩️ Realizar Devolución de Venta",
                                     command=self.realizar_devolucion, bootstyle="danger")
         btn_devolucion.pack(pady=5)
+        ttk.Button(ventas_frame, text="🧾 Reimprimir Recibo", command=self.reimprimir_recibo,
+                   bootstyle="secondary").pack(pady=(0, 5))
 
         # Frame de Botones de Exportación
         export_btn_frame = ttk.Frame(ventas_frame)
@@ -358,6 +425,16 @@ class POSApp:
             side='left', padx=5, fill='x', expand=True)
         ttk.Button(export_btn_frame, text="📊 Exportar a Excel", command=self.exportar_a_excel,
                    bootstyle="success").pack(side='left', padx=5, fill='x', expand=True)
+        ttk.Button(export_btn_frame, text="🗂️ Exportar Año por Mes (PDF/Excel/CSV)",
+                   command=self.encolar_exportacion_anual, bootstyle="secondary").pack(side='left', padx=5, fill='x',
+                                                                                      expand=True)
+        self.exportaciones_label = ttk.Label(ventas_frame, text="", bootstyle="secondary")
+        self.exportaciones_label.pack(anchor='w', padx=5)
+
+        # Exportación incremental: solo ventas nuevas y devoluciones desde la última exportación
+        self.export_incremental = tk.BooleanVar(value=False)
+        ttk.Checkbutton(ventas_frame, text="Solo ventas nuevas desde la última exportación (incremental)",
+                        variable=self.export_incremental, bootstyle="info").pack(anchor='w', padx=5)
 
         # Pestaña de Caja y Ganancias
         caja_frame = ttk.Frame(notebook, padding=5)
@@ -370,13 +447,95 @@ class POSApp:
             self.caja_tree.column(col, width=120, anchor='center')
         self.caja_tree.pack(fill='both', expand=True)
 
+        ttk.Button(caja_frame, text="💾 Respaldar Base de Datos Ahora", command=self.respaldar_ahora,
+                   bootstyle="secondary").pack(pady=5)
+
     # ====================================================================
     #           MÉTODOS DE INVENTARIO Y DEVOLUCIÓN (Nuevos/Modificados)
     # ====================================================================
 
     def open_recepcion_mercancia(self):
         """Abre la ventana para aumentar el stock de productos."""
-        RecepcionMercanciaWindow(self.root, self.conn, self.cargar_productos)
+        RecepcionMercanciaWindow(self.root, self.repo, self.cargar_productos)
+
+    def open_stock_a_fecha(self):
+        """Ventana para consultar el stock de cada producto al cierre de un día dado."""
+        top = tk.Toplevel(self.root)
+        top.title("📅 Stock a Fecha")
+
+        frame = ttk.Frame(top, padding=10)
+        frame.pack(expand=True, fill='both')
+
+        ttk.Label(frame, text="Fecha (AAAA-MM-DD, al cierre del día):", bootstyle="info").grid(row=0, column=0, padx=5,
+                                                                                             pady=5, sticky='w')
+        fecha_entry = ttk.Entry(frame, width=12, bootstyle="secondary")
+        fecha_entry.insert(0, datetime.date.today().replace(day=1).strftime("%Y-%m-%d"))
+        fecha_entry.grid(row=0, column=1, padx=5, pady=5, sticky='w')
+
+        tree = ttk.Treeview(frame, columns=("ID", "Nombre", "Stock"), show='headings', height=15, bootstyle="default")
+        for col in ("ID", "Nombre", "Stock"):
+            tree.heading(col, text=col)
+            tree.column(col, width=80, anchor='center')
+        tree.column("Nombre", width=200)
+        tree.grid(row=1, column=0, columnspan=3, pady=10, sticky='nsew')
+
+        def consultar():
+            try:
+                fecha = datetime.datetime.strptime(fecha_entry.get().strip(), "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "La fecha debe tener el formato AAAA-MM-DD.", parent=top)
+                return
+            for item in tree.get_children():
+                tree.delete(item)
+            for prod_id, nombre, stock in self.repo.stock.a_fecha(fecha.strftime("%Y-%m-%d 23:59:59")):
+                tree.insert("", "end", values=(prod_id, nombre, stock))
+
+        ttk.Button(frame, text="🔍 Consultar", command=consultar, bootstyle="primary").grid(row=0, column=2, padx=5,
+                                                                                          pady=5)
+        frame.grid_columnconfigure(1, weight=1)
+        frame.grid_rowconfigure(1, weight=1)
+        consultar()
+
+    def respaldar_ahora(self):
+        """Pide un respaldo inmediato; se ejecuta en segundo plano mientras se sigue vendiendo."""
+        self.gestor_respaldos.solicitar()
+        messagebox.showinfo("Respaldo", f"Respaldo en curso. Se guardará en la carpeta '{RESPALDOS_DIR}'.")
+
+    def registrar_actividad(self, event=None):
+        self.ultima_actividad = time.monotonic()
+        self.mantenimiento_en_reposo_hecho = False
+
+    def revisar_mantenimiento(self):
+        # Un mantenimiento ligero por cada período de inactividad del cajero
+        inactivo = time.monotonic() - self.ultima_actividad
+        if inactivo >= MANTENIMIENTO_REPOSO_MIN * 60 and not self.mantenimiento_en_reposo_hecho:
+            self.mantenimiento_en_reposo_hecho = self.gestor_mantenimiento.ejecutar_en_segundo_plano()
+        self.root.after(MANTENIMIENTO_REVISION_MS, self.revisar_mantenimiento)
+
+    def on_cerrar(self):
+        self.cola_recibos.detener()
+        self.gestor_respaldos.detener()
+        if self.ejecutor_exportaciones:
+            self.ejecutor_exportaciones.detener()
+        for linea in self.repo.resumen_tiempos():
+            logger.info(linea)
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+        self.root.destroy()
+
+    def reimprimir_recibo(self):
+        selected_item = self.ventas_tree.focus()
+        if not selected_item:
+            messagebox.showerror("Error", "Selecciona una venta del historial para reimprimir su recibo.")
+            return
+
+        venta_id = int(self.ventas_tree.item(selected_item, 'values')[0])
+        venta = self.repo.ventas.obtener(venta_id)
+        if venta is None:
+            messagebox.showerror("Error", f"La venta ID {venta_id} no existe.")
+            return
+        self.cola_recibos.encolar(venta, reimpresion=True)
+        self.ultima_venta_label.config(text=f"🧾 Recibo de la venta #{venta_id} enviado a imprimir.")
 
     # --- Devolución de Venta ---
 
@@ -400,107 +559,158 @@ class POSApp:
             return
 
         try:
-            # 1. Analizar los detalles para reponer el stock
-            items = detalles.split(' | ')
-            for item in items:
-                # Ejemplo: 'Producto A (2 x C$10.00)'
-                # Extraemos Nombre, Cantidad, Precio
-                nombre = item.split('(')[0].strip()
-                cantidad_precio = item.split('(')[1].replace(')', '')
-                cantidad = int(cantidad_precio.split(' x ')[0])
-
-                # Buscamos el ID del producto por nombre (o ajustamos la lógica si se usaran códigos)
-                self.cursor.execute("SELECT id FROM productos WHERE nombre=?", (nombre,))
-                prod_result = self.cursor.fetchone()
-
-                if prod_result:
-                    prod_id = prod_result[0]
-                    # Reponer stock
-                    self.cursor.execute("UPDATE productos SET stock = stock + ? WHERE id=?", (cantidad, prod_id))
-                else:
-                    # En un sistema real, esto debería registrarse, pero por simplicidad mostramos error
-                    messagebox.showwarning("Error Parcial", f"No se pudo reponer el stock para '{nombre}'.")
-                    # No hacemos un 'continue', intentamos seguir con la transacción
-
-            # 2. Marcar la venta como devolución en la BD
-            self.cursor.execute("UPDATE ventas SET es_devolucion=1 WHERE id=?", (venta_id,))
-
-            # 3. Ajustar la ganancia de la caja (asumiendo que total es ganancia bruta en este sistema)
-            # CAMBIO 3: Reemplazar 'C$' o '$' al parsear el total
-            total_devuelto = float(total.replace('C$', '').replace('$', ''))
+            caja_id = self.current_caja_id if self.caja_abierta else None
+            total_devuelto, no_repuestos = registrar_devolucion(self.repo, venta_id, caja_id)
+            self.repo.commit()
 
             if self.caja_abierta:
                 self.ganancia_caja_actual -= total_devuelto
-                self.cursor.execute("UPDATE caja SET ganancia_total=? WHERE id=?",
-                                    (self.ganancia_caja_actual, self.current_caja_id))
 
-            self.conn.commit()
+            for nombre in no_repuestos:
+                # En un sistema real, esto debería registrarse, pero por simplicidad mostramos error
+                messagebox.showwarning("Error Parcial", f"No se pudo reponer el stock para '{nombre}'.")
 
             messagebox.showinfo("Éxito",
                                 f"Devolución de Venta ID {venta_id} procesada exitosamente. Stock repuesto y caja ajustada.")
 
             self.cargar_productos()
-            self.cargar_registros_ventas()
+            self.actualizar_venta_en_historial(venta_id)
             self.update_caja_gui()
 
         except Exception as e:
-            self.conn.rollback()
+            self.repo.rollback()
             messagebox.showerror("Error de Devolución", f"Ocurrió un error al procesar la devolución: {e}")
 
     # --- Sobreescribir Cargar Ventas ---
 
     def cargar_registros_ventas(self):
+        # Solo las últimas ventas; el resto del historial se consulta con la búsqueda
+        self.ventas_filtradas = False
+        self.mostrar_ventas(self.repo.ventas.recientes(LIMITE_BUSQUEDA_VENTAS))
+
+    def mostrar_ventas(self, ventas):
         for item in self.ventas_tree.get_children():
             self.ventas_tree.delete(item)
 
-        # Consulta que incluye la columna 'es_devolucion'
-        self.cursor.execute("SELECT id, fecha, total, detalles, es_devolucion FROM ventas ORDER BY id DESC")
-        ventas = self.cursor.fetchall()
-
         for venta in ventas:
-            venta_id, fecha, total, detalles, es_devolucion = venta
-
-            estado_display = "DEVOLUCIÓN" if es_devolucion else "VENDIDO"
-            tag = "devolucion" if es_devolucion else "vendido"
-
-            # CAMBIO 4: Reemplazar $ por C$ al insertar en el Treeview
-            self.ventas_tree.insert("", "end", values=(
-                venta_id,
-                fecha.split(' ')[0],
-                f"C${total:.2f}",
-                detalles.replace('$', 'C$'),  # Reemplazar $ por C$ dentro del detalle para consistencia
-                estado_display
-            ), tags=(tag,))
+            valores, tag = self.valores_venta(venta)
+            self.ventas_tree.insert("", "end", iid=str(venta.id), values=valores, tags=(tag,))
 
         # Configurar tags visuales
         self.ventas_tree.tag_configure("devolucion", background='#f8d7da',
                                        foreground='#721c24')  # Rojo claro/Oscuro para devolución
         self.ventas_tree.tag_configure("vendido", background='white', foreground='black')
 
+    def valores_venta(self, venta):
+        """(valores de la fila, tag) de una venta para el Treeview del historial."""
+        estado_display = "DEVOLUCIÓN" if venta.es_devolucion else "VENDIDO"
+        tag = "devolucion" if venta.es_devolucion else "vendido"
+
+        # CAMBIO 4: Reemplazar $ por C$ al insertar en el Treeview
+        return (
+            venta.id,
+            venta.fecha.split(' ')[0],
+            f"C${venta.total:.2f}",
+            venta.detalles.replace('$', 'C$'),  # Reemplazar $ por C$ dentro del detalle para consistencia
+            estado_display
+        ), tag
+
+    def actualizar_venta_en_historial(self, venta_id):
+        """Inserta o actualiza solo la fila de esa venta, sin recargar el historial."""
+        venta = self.repo.ventas.obtener(venta_id)
+        iid = str(venta_id)
+        valores, tag = self.valores_venta(venta)
+        if self.ventas_tree.exists(iid):
+            self.ventas_tree.item(iid, values=valores, tags=(tag,))
+        elif not self.ventas_filtradas:
+            # Venta nueva: arriba de todo, y la lista sigue mostrando solo las últimas
+            self.ventas_tree.insert("", 0, iid=iid, values=valores, tags=(tag,))
+            filas = self.ventas_tree.get_children()
+            for item in filas[LIMITE_BUSQUEDA_VENTAS:]:
+                self.ventas_tree.delete(item)
+
+    # --- Búsqueda en el Historial de Ventas ---
+
+    def buscar_ventas(self):
+        texto = self.ventas_texto_entry.get().strip()
+        try:
+            desde = self.leer_fecha_busqueda(self.ventas_desde_entry)
+            hasta = self.leer_fecha_busqueda(self.ventas_hasta_entry)
+            total_min = self.ventas_total_entry.get().strip().replace('C$', '')
+            total_min = float(total_min) if total_min else None
+        except ValueError:
+            messagebox.showerror("Error", "Fechas en formato AAAA-MM-DD y total mínimo numérico.")
+            return
+
+        self.ventas_filtradas = True
+        self.mostrar_ventas(self.repo.ventas.buscar(self.fts_ventas, texto, desde, hasta, total_min))
+
+    def leer_fecha_busqueda(self, entry):
+        valor = entry.get().strip()
+        return datetime.datetime.strptime(valor, "%Y-%m-%d").date() if valor else None
+
+    def limpiar_busqueda_ventas(self):
+        for entry in (self.ventas_texto_entry, self.ventas_desde_entry, self.ventas_hasta_entry,
+                      self.ventas_total_entry):
+            entry.delete(0, tk.END)
+        self.cargar_registros_ventas()
+
     # ====================================================================
     #           MÉTODOS INALTERADOS
     # ====================================================================
 
     def cargar_productos(self, busqueda=""):
-        # ... (Función de cargar productos) ...
+        # Reinicia el Treeview y carga la primera página con el filtro y el orden actuales
         for item in self.productos_tree.get_children():
             self.productos_tree.delete(item)
 
-        query = "SELECT id, nombre, categoria, stock, precio FROM productos"
-        if busqueda:
-            query += f" WHERE nombre LIKE '%{busqueda}%' OR categoria LIKE '%{busqueda}%' OR id LIKE '{busqueda}%'"
+        self.productos_busqueda = busqueda
+        self.productos_offset = 0
+        self.productos_hay_mas = False
+        self.cargar_pagina_productos()
+
+        self.productos_tree.tag_configure('low_stock', foreground='red', font=("Segoe UI", 10, "bold"))
 
-        self.cursor.execute(query)
-        productos = self.cursor.fetchall()
+    def cargar_pagina_productos(self):
+        # El orden se resuelve en SQLite (con índice por columna) y solo se traen PAGINA_PRODUCTOS filas
+        columna, descendente = self.orden_productos
+        productos = self.repo.productos.pagina(self.productos_busqueda, columna, descendente, self.productos_offset,
+                                               PAGINA_PRODUCTOS + 1)
+
+        self.productos_hay_mas = len(productos) > PAGINA_PRODUCTOS
+        productos = productos[:PAGINA_PRODUCTOS]
+        self.productos_offset += len(productos)
 
         for prod in productos:
-            tag = 'low_stock' if prod[3] < 5 else ''
-            stock_str = f"⚠️ {prod[3]}" if prod[3] < 5 else prod[3]
+            tag = 'low_stock' if prod.stock < 5 else ''
+            stock_str = f"⚠️ {prod.stock}" if prod.stock < 5 else prod.stock
             # CAMBIO 5: Reemplazar $ por C$ al insertar en el Treeview de productos
-            self.productos_tree.insert("", "end", values=(prod[0], prod[1], prod[2], stock_str, f"C${prod[4]:.2f}"),
-                                       tags=(tag,))
+            self.productos_tree.insert("", "end", values=(prod.id, prod.nombre, prod.categoria, stock_str,
+                                                          f"C${prod.precio:.2f}"), tags=(tag,))
 
-        self.productos_tree.tag_configure('low_stock', foreground='red', font=("Segoe UI", 10, "bold"))
+        self.productos_cargando = False
+
+    def on_scroll_productos(self, first, last):
+        self.productos_vsb.set(first, last)
+        # Si el usuario llegó al final de lo cargado, se pide la siguiente página fuera del callback
+        if float(last) >= 1.0 and self.productos_hay_mas and not self.productos_cargando:
+            self.productos_cargando = True
+            self.root.after_idle(self.cargar_pagina_productos)
+
+    def ordenar_productos(self, columna):
+        # Un clic en el mismo encabezado invierte el orden; en otro encabezado ordena ascendente
+        actual, descendente = self.orden_productos
+        descendente = not descendente if columna == actual else False
+        self.orden_productos = (columna, descendente)
+
+        for col in ORDEN_PRODUCTOS:
+            texto = col
+            if col == columna:
+                texto += " ▼" if descendente else " ▲"
+            self.productos_tree.heading(col, text=texto)
+
+        self.cargar_productos(self.productos_busqueda)
+        self.productos_tree.yview_moveto(0)
 
     def buscar_producto(self, event):
         busqueda = self.search_entry.get()
@@ -517,9 +727,7 @@ class POSApp:
 
         producto_id = self.productos_tree.item(selected_item, 'values')[0]
 
-        self.cursor.execute("SELECT id, nombre, categoria, descripcion, stock, precio FROM productos WHERE id=?",
-                            (producto_id,))
-        producto = self.cursor.fetchone()
+        producto = self.repo.productos.obtener(producto_id)
 
         if producto:
             self.create_producto_form_window("Editar", producto)
@@ -573,8 +781,7 @@ class POSApp:
             if mode == "Agregar":
                 stock = int(entries["Stock"].get())
             else:
-                self.cursor.execute("SELECT stock FROM productos WHERE id=?", (producto_id,))
-                stock = self.cursor.fetchone()[0]  # Mantiene el stock actual
+                stock = self.repo.productos.stock(producto_id)  # Mantiene el stock actual
 
             precio = float(entries["Precio"].get())
 
@@ -582,23 +789,20 @@ class POSApp:
                 raise ValueError("Campos obligatorios incompletos o valores inválidos (Stock/Precio).")
 
             if mode == "Agregar":
-                self.cursor.execute(
-                    "INSERT INTO productos (nombre, categoria, descripcion, stock, precio) VALUES (?, ?, ?, ?, ?)",
-                    (nombre, categoria, descripcion, stock, precio))
+                alta_producto(self.repo, nombre, categoria, descripcion, stock, precio)
                 messagebox.showinfo("Éxito", "Producto agregado correctamente.")
             elif mode == "Editar":
-                self.cursor.execute(
-                    "UPDATE productos SET nombre=?, categoria=?, descripcion=?, precio=? WHERE id=?",
-                    (nombre, categoria, descripcion, precio, producto_id))
+                self.repo.productos.actualizar(producto_id, nombre, categoria, descripcion, precio)
                 messagebox.showinfo("Éxito", "Producto editado correctamente.")
 
-            self.conn.commit()
+            self.repo.commit()
             self.cargar_productos()
             top_window.destroy()
 
         except ValueError as e:
             messagebox.showerror("Error de Validación", str(e))
         except Exception as e:
+            self.repo.rollback()
             messagebox.showerror("Error de BD", f"Ocurrió un error al guardar: {e}")
 
     def eliminar_producto(self):
@@ -614,8 +818,8 @@ class POSApp:
         if messagebox.askyesno("Confirmar Eliminación",
                                f"¿Estás seguro de eliminar el producto '{nombre}' (ID: {producto_id})?"):
             try:
-                self.cursor.execute("DELETE FROM productos WHERE id=?", (producto_id,))
-                self.conn.commit()
+                self.repo.productos.eliminar(producto_id)
+                self.repo.commit()
                 messagebox.showinfo("Éxito", "Producto eliminado correctamente.")
                 self.cargar_productos()
             except Exception as e:
@@ -623,13 +827,12 @@ class POSApp:
 
     def check_caja_status(self):
         # ... (Función de chequear estado de caja) ...
-        self.cursor.execute("SELECT id, ganancia_total FROM caja WHERE estado='Abierta' ORDER BY id DESC LIMIT 1")
-        last_caja = self.cursor.fetchone()
+        last_caja = self.repo.cajas.abierta()
 
         if last_caja:
             self.caja_abierta = True
-            self.current_caja_id = last_caja[0]
-            self.ganancia_caja_actual = last_caja[1]
+            self.current_caja_id = last_caja.id
+            self.ganancia_caja_actual = last_caja.ganancia_total
             self.update_caja_gui()
         else:
             self.caja_abierta = False
@@ -645,10 +848,11 @@ class POSApp:
                                        f"¿Deseas cerrar la caja? Ganancia total actual: C${self.ganancia_caja_actual:.2f}"):
                 return
 
-            fecha_cierre = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute("UPDATE caja SET estado='Cerrada', fecha_cierre=?, ganancia_total=? WHERE id=?",
-                                (fecha_cierre, self.ganancia_caja_actual, self.current_caja_id))
-            self.conn.commit()
+            cerrar_caja(self.repo, self.current_caja_id, self.ganancia_caja_actual)
+            self.repo.commit()
+
+            # Con la caja cerrada se hace el mantenimiento completo (ANALYZE, vacuum, checkpoint)
+            self.gestor_mantenimiento.ejecutar_en_segundo_plano(completo=True)
 
             self.caja_abierta = False
             self.ganancia_caja_actual = 0.0
@@ -658,11 +862,8 @@ class POSApp:
             self.cargar_registros_caja()
 
         else:
-            fecha_apertura = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute("INSERT INTO caja (estado, fecha_apertura, ganancia_total) VALUES (?, ?, ?)",
-                                ('Abierta', fecha_apertura, 0.0))
-            self.conn.commit()
-            self.current_caja_id = self.cursor.lastrowid
+            self.current_caja_id = abrir_caja(self.repo)
+            self.repo.commit()
             self.caja_abierta = True
             messagebox.showinfo("Caja Abierta", "Caja abierta. Puedes empezar a vender.")
 
@@ -701,63 +902,99 @@ class POSApp:
             messagebox.showerror("Error", "La cantidad debe ser un número entero positivo.")
             return
 
-        query = "SELECT id, nombre, stock, precio FROM productos WHERE id=? OR nombre LIKE ?"
-        self.cursor.execute(query, (search_term, f'%{search_term}%'))
-        productos = self.cursor.fetchall()
+        producto = self.repo.productos.buscar_para_venta(search_term)
 
-        if not productos:
+        if not producto:
             messagebox.showerror("Error", "Producto no encontrado.")
             return
 
-        producto = productos[0]
         prod_id, nombre, stock_actual, precio = producto
 
-        if cantidad > stock_actual:
+        # Se cuenta también lo que ya está en el carrito de este producto
+        if cantidad + self.carrito.cantidad_de(prod_id) > stock_actual:
             messagebox.showwarning("Stock Insuficiente", f"Solo hay {stock_actual} unidades de '{nombre}' en stock.")
             return
 
-        if prod_id in self.productos_carrito:
-            self.productos_carrito[prod_id]['cantidad'] += cantidad
-        else:
-            self.productos_carrito[prod_id] = {
-                'nombre': nombre,
-                'precio': precio,
-                'cantidad': cantidad
-            }
+        linea = self.carrito.agregar(prod_id, nombre, precio, cantidad)
 
         self.venta_search_entry.delete(0, tk.END)
         self.cantidad_entry.delete(0, tk.END)
 
-        self.update_carrito_gui()
+        self.actualizar_linea_carrito(linea)
+
+    def actualizar_linea_carrito(self, linea):
+        """Actualiza solo la fila del producto afectado y el total (sin reconstruir el Treeview)."""
+        iid = str(linea.producto_id)
+        valores = (
+            linea.nombre,
+            linea.cantidad,
+            # CAMBIO 9: Reemplazar $ por C$ en el precio unitario
+            formatear_centavos(linea.precio_centavos),
+            # CAMBIO 10: Reemplazar $ por C$ en el subtotal
+            formatear_centavos(linea.subtotal_centavos)
+        )
+        if self.carrito_tree.exists(iid):
+            self.carrito_tree.item(iid, values=valores)
+        else:
+            self.carrito_tree.insert("", "end", iid=iid, values=valores)
+        self.carrito_tree.see(iid)
+        self.update_total_gui()
+
+    def update_total_gui(self):
+        # CAMBIO 11: Reemplazar $ por C$ en el label total
+        self.total_label.config(text=formatear_centavos(self.carrito.total_centavos))
 
     def update_carrito_gui(self):
-        # ... (Función de actualizar GUI del carrito) ...
+        # Reconstrucción completa: solo se usa al vaciar el carrito o después de una venta
         for item in self.carrito_tree.get_children():
             self.carrito_tree.delete(item)
 
-        total_venta = 0.0
+        for linea in self.carrito:
+            self.actualizar_linea_carrito(linea)
 
-        for prod_id, data in self.productos_carrito.items():
-            subtotal = data['precio'] * data['cantidad']
-            total_venta += subtotal
+        self.update_total_gui()
 
-            self.carrito_tree.insert("", "end", values=(
-                data['nombre'],
-                data['cantidad'],
-                # CAMBIO 9: Reemplazar $ por C$ en el precio unitario
-                f"C${data['precio']:.2f}",
-                # CAMBIO 10: Reemplazar $ por C$ en el subtotal
-                f"C${subtotal:.2f}"
-            ), tags=(prod_id,))
+    def producto_seleccionado_carrito(self):
+        selected_item = self.carrito_tree.focus()
+        if not selected_item:
+            messagebox.showerror("Error", "Selecciona un producto del carrito.")
+            return None
+        return int(selected_item)
 
-        # CAMBIO 11: Reemplazar $ por C$ en el label total
-        self.total_label.config(text=f"C${total_venta:.2f}")
+    def editar_cantidad_carrito(self):
+        prod_id = self.producto_seleccionado_carrito()
+        if prod_id is None:
+            return
+
+        cantidad = simpledialog.askinteger("Cambiar Cantidad", "Nueva cantidad (0 para quitar):", parent=self.root,
+                                           initialvalue=self.carrito.cantidad_de(prod_id), minvalue=0)
+        if cantidad is None:
+            return
+        if cantidad == 0:
+            self.quitar_del_carrito()
+            return
+
+        stock_actual = self.repo.productos.stock(prod_id)
+        if cantidad > stock_actual:
+            messagebox.showwarning("Stock Insuficiente", f"Solo hay {stock_actual} unidades en stock.")
+            return
+
+        self.actualizar_linea_carrito(self.carrito.cambiar_cantidad(prod_id, cantidad))
+
+    def quitar_del_carrito(self):
+        prod_id = self.producto_seleccionado_carrito()
+        if prod_id is None:
+            return
+
+        self.carrito.quitar(prod_id)
+        self.carrito_tree.delete(str(prod_id))
+        self.update_total_gui()
 
     def vaciar_carrito(self):
         # ... (Función de vaciar carrito) ...
-        if self.productos_carrito:
+        if self.carrito:
             if messagebox.askyesno("Confirmar", "¿Deseas vaciar el carrito actual?"):
-                self.productos_carrito = {}
+                self.carrito.vaciar()
                 self.update_carrito_gui()
 
     def finalizar_venta(self):
@@ -766,47 +1003,46 @@ class POSApp:
             messagebox.showerror("Error", "Debes abrir caja para realizar ventas.")
             return
 
-        if not self.productos_carrito:
+        if not self.carrito:
             messagebox.showerror("Error", "El carrito está vacío.")
             return
 
-        # CAMBIO 12: Reemplazar 'C$' al obtener el total de la etiqueta
-        total_venta = float(self.total_label.cget("text").replace('C$', ''))
-        fecha_venta = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        detalles_venta = []
-        ganancia_bruta = 0.0
-
-        for prod_id, data in self.productos_carrito.items():
-            cantidad = data['cantidad']
-            precio = data['precio']
-            nombre = data['nombre']
-
-            self.cursor.execute("UPDATE productos SET stock = stock - ? WHERE id=?", (cantidad, prod_id))
-
-            # CAMBIO 13: Reemplazar $ por C$ en los detalles que se guardan
-            detalles_venta.append(f"{nombre} ({cantidad} x C${precio:.2f})")
-
-            ganancia_bruta += (precio * cantidad)
-
-        detalles_str = " | ".join(detalles_venta)
-        # La nueva columna 'es_devolucion' tiene un DEFAULT 0, no necesitamos especificarla aquí.
-        self.cursor.execute("INSERT INTO ventas (fecha, total, detalles) VALUES (?, ?, ?)",
-                            (fecha_venta, total_venta, detalles_str))
-
-        self.ganancia_caja_actual += ganancia_bruta
-        self.cursor.execute("UPDATE caja SET ganancia_total=? WHERE id=?",
-                            (self.ganancia_caja_actual, self.current_caja_id))
-
-        self.conn.commit()
+        try:
+            venta_id, total_venta = registrar_venta(self.repo, self.carrito, self.current_caja_id)
+            self.repo.commit()
+        except Exception as e:
+            # Venta, stock y libro de movimientos van en la misma transacción: o todo o nada.
+            # El carrito se conserva para reintentar.
+            self.repo.rollback()
+            messagebox.showerror("Error de Venta", f"No se pudo registrar la venta: {e}")
+            return
+        self.ganancia_caja_actual += total_venta
 
+        # El recibo se renderiza e imprime en el hilo de recibos; aquí solo se encola
+        self.cola_recibos.encolar(self.repo.ventas.obtener(venta_id))
         # CAMBIO 14: Reemplazar $ por C$ en el mensaje de éxito
-        messagebox.showinfo("Venta Exitosa", f"Venta registrada por C${total_venta:.2f}")
-        self.productos_carrito = {}
+        self.ultima_venta_label.config(
+            text=f"✔ Venta #{venta_id} registrada por C${total_venta:.2f}. Imprimiendo recibo...")
+        self.carrito.vaciar()
         self.update_carrito_gui()
         self.cargar_productos()
-        self.cargar_registros_ventas()
+        self.actualizar_venta_en_historial(venta_id)
         self.update_caja_gui()
 
+    def consultar_ventas_exportar(self, formato, incremental):
+        """Devuelve (filas, marca). En modo incremental solo trae las ventas con id mayor a la marca
+        y las ventas anteriores que se devolvieron después de la última exportación."""
+        marca = self.repo.ventas.marca_exportacion(formato)
+        if not incremental:
+            return self.repo.ventas.para_exportar(), marca
+        return self.repo.ventas.para_exportar(marca), marca
+
+    def guardar_marca_exportacion(self, formato, data, marca, archivo):
+        nueva = siguiente_marca_exportacion(marca, data, archivo)
+        self.repo.ventas.guardar_marca_exportacion(formato, nueva,
+                                                   datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.repo.commit()
+
     def exportar_a_excel(self):
         # ... (Función de exportar a Excel) ...
         if not EXPORT_AVAILABLE:
@@ -814,29 +1050,48 @@ class POSApp:
             return
 
         try:
-            # Consulta actualizada para obtener la columna es_devolucion
-            self.cursor.execute("SELECT id, fecha, total, detalles, es_devolucion FROM ventas ORDER BY id DESC")
-            data = self.cursor.fetchall()
+            incremental = self.export_incremental.get()
+            data, marca = self.consultar_ventas_exportar('excel', incremental)
 
             if not data:
                 messagebox.showwarning("Advertencia", "No hay registros de ventas para exportar.")
                 return
 
             columnas = ["ID Venta", "Fecha", "Total", "Detalles de Venta", "Es Devolución (1/0)"]
-            df = pd.DataFrame(data, columns=columnas)
+            df = pd.DataFrame([row[:5] for row in data], columns=columnas)
 
             # Forzamos el cambio de $ a C$ en los detalles antes de exportar
             df['Detalles de Venta'] = df['Detalles de Venta'].str.replace('$', 'C$')
 
-            filepath = filedialog.asksaveasfilename(
+            # En modo incremental se reutiliza el archivo base de la exportación anterior sin preguntar
+            filepath = marca.archivo if incremental and marca.archivo else filedialog.asksaveasfilename(
                 defaultextension=".xlsx",
                 filetypes=[("Archivos Excel", "*.xlsx")],
                 title="Guardar Registro de Ventas (Excel)"
             )
 
-            if filepath:
+            if not filepath:
+                return
+
+            if not incremental:
                 df.to_excel(filepath, index=False)
                 messagebox.showinfo("Éxito", f"Datos exportados a Excel:\n{filepath}")
+                return
+
+            # Se agrega al libro del mes en curso; al cambiar de mes se empieza un libro nuevo,
+            # así cada ejecución solo reescribe un archivo acotado.
+            archivo_mes = f"{os.path.splitext(filepath)[0]}_{datetime.date.today():%Y-%m}.xlsx"
+            if os.path.exists(archivo_mes):
+                libro = load_workbook(archivo_mes)
+                hoja = libro.active
+                for fila in df.itertuples(index=False):
+                    hoja.append(list(fila))
+                libro.save(archivo_mes)
+            else:
+                df.to_excel(archivo_mes, index=False)
+
+            self.guardar_marca_exportacion('excel', data, marca, filepath)
+            messagebox.showinfo("Éxito", f"{len(data)} registros nuevos exportados a Excel:\n{archivo_mes}")
 
         except Exception as e:
             messagebox.showerror("Error de Exportación", f"Ocurrió un error al exportar a Excel: {e}")
@@ -848,15 +1103,14 @@ class POSApp:
             return
 
         try:
-            # Consulta actualizada para obtener la columna es_devolucion
-            self.cursor.execute("SELECT id, fecha, total, detalles, es_devolucion FROM ventas ORDER BY id DESC")
-            data = self.cursor.fetchall()
+            incremental = self.export_incremental.get()
+            data, marca = self.consultar_ventas_exportar('pdf', incremental)
 
             if not data:
                 messagebox.showwarning("Advertencia", "No hay registros de ventas para exportar.")
                 return
 
-            filepath = filedialog.asksaveasfilename(
+            filepath = marca.archivo if incremental and marca.archivo else filedialog.asksaveasfilename(
                 defaultextension=".pdf",
                 filetypes=[("Archivos PDF", "*.pdf")],
                 title="Guardar Registro de Ventas (PDF)"
@@ -865,72 +1119,50 @@ class POSApp:
             if not filepath:
                 return
 
-            doc = SimpleDocTemplate(filepath, pagesize=letter)
-            styles = getSampleStyleSheet()
-            elementos = []
-
-            elementos.append(Paragraph("REPORTE DE HISTORIAL DE VENTAS", styles['h1']))
-            elementos.append(Paragraph(f"Fecha de Reporte: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                                       styles['Normal']))
-            elementos.append(Paragraph("<br/>", styles['Normal']))
-
-            header = ["ID Venta", "Fecha", "Total", "Detalles", "Estado"]
-            table_data = [header]
-            total_ventas = 0.0
-
-            for row in data:
-                # CAMBIO 15: Reemplazar $ por C$ al mostrar el total
-                total_str = f"C${row[2]:.2f}"
-                detalles_str = row[3].replace('$', 'C$')  # Asegurar que los detalles en el PDF también usen C$
-
-                if row[4] == 0:
-                    total_ventas += row[2]  # Solo suma las ventas no devueltas al total general
-                    estado = "VENDIDO"
-                else:
-                    estado = "DEVOLUCIÓN"
-
-                table_data.append([row[0], row[1].split(' ')[0], total_str, detalles_str, estado])
-
-            table = Table(table_data, colWidths=[50, 80, 70, 270, 70])
-
-            style = TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('ALIGN', (2, 1), (2, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ])
-            table.setStyle(style)
-            elementos.append(table)
-
-            elementos.append(Paragraph("<br/>", styles['Normal']))
-            # CAMBIO 16: Reemplazar $ por C$ en el total neto del PDF
-            elementos.append(
-                Paragraph(f"TOTAL NETO DE VENTAS (SIN DEVOLUCIONES): <font color='red'>C${total_ventas:.2f}</font>",
-                          styles['h3']))
-
-            doc.build(elementos)
-            messagebox.showinfo("Éxito", f"Datos exportados a PDF:\n{filepath}")
+            if incremental:
+                # Un PDF no admite agregar páginas: cada ejecución genera un archivo nuevo junto al anterior
+                archivo = f"{os.path.splitext(filepath)[0]}_{datetime.datetime.now():%Y-%m-%d_%H%M%S}.pdf"
+                generar_pdf_ventas(archivo, data, "REPORTE INCREMENTAL DE VENTAS", ajustes_hasta_id=marca.ultimo_id)
+                self.guardar_marca_exportacion('pdf', data, marca, filepath)
+                messagebox.showinfo("Éxito", f"{len(data)} registros nuevos exportados a PDF:\n{archivo}")
+            else:
+                generar_pdf_ventas(filepath, data, "REPORTE DE HISTORIAL DE VENTAS")
+                messagebox.showinfo("Éxito", f"Datos exportados a PDF:\n{filepath}")
 
         except Exception as e:
             messagebox.showerror("Error de Exportación",
                                  f"Ocurrió un error al exportar a PDF. Error: {e}")
 
+    def encolar_exportacion_anual(self):
+        """Encola la exportación del año, un archivo por mes y formato, sin bloquear la caja."""
+        if not EXPORT_AVAILABLE:
+            messagebox.showerror("Error de Exportación", "Las librerías 'pandas' y 'reportlab' no están instaladas.")
+            return
+
+        anio = simpledialog.askinteger("Exportar Año", "Año a exportar:", parent=self.root,
+                                       initialvalue=datetime.date.today().year, minvalue=2000, maxvalue=2100)
+        if not anio:
+            return
+        carpeta = filedialog.askdirectory(title="Carpeta de destino de la exportación")
+        if not carpeta:
+            return
+
+        self.ejecutor_exportaciones.encolar(anio, carpeta)
+        self.actualizar_estado_exportaciones()
+
+    def actualizar_estado_exportaciones(self):
+        # Consulta periódica del progreso: los trabajos corren en otro hilo y no pueden tocar la interfaz
+        trabajos = self.ejecutor_exportaciones.trabajos
+        self.exportaciones_label.config(text=" | ".join(t.resumen() for t in trabajos[-3:]))
+        if any(not t.terminado for t in trabajos):
+            self.root.after(500, self.actualizar_estado_exportaciones)
+
     def cargar_registros_caja(self):
         # ... (Función de cargar registros de caja) ...
         for item in self.caja_tree.get_children():
             self.caja_tree.delete(item)
 
-        self.cursor.execute(
-            "SELECT id, estado, fecha_apertura, fecha_cierre, ganancia_total FROM caja ORDER BY id DESC")
-        cajas = self.cursor.fetchall()
-
-        for caja in cajas:
+        for caja in self.repo.cajas.todas():
             fecha_cierre_disp = caja[3].split(' ')[0] if caja[3] else "N/A"
             # CAMBIO 17: Reemplazar $ por C$ al cargar la ganancia
             self.caja_tree.insert("", "end", values=(
@@ -952,6 +1184,9 @@ class POSApp:
 # ====================================================================
 
 if __name__ == "__main__":
+    # Necesario para el pool de procesos de exportación en el ejecutable de PyInstaller (Windows)
+    multiprocessing.freeze_support()
+    logging.basicConfig(filename='pos.log', level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
     root = tk.Tk()
     app = POSApp(root)
     root.mainloop()
\ No newline at end of file
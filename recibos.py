@@ -0,0 +1,280 @@
+"""Recibos de venta: renderizado ESC/POS y PDF con cola de impresión en segundo plano.
+
+Las plantillas se compilan una sola vez por ancho de papel (bytes fijos del
+encabezado y el pie, formatos de línea ya calculados) y quedan en caché; cada
+recibo solo rellena las líneas de la venta. ColaRecibos renderiza y envía los
+recibos desde un hilo aparte, así finalizar_venta no espera a la impresora.
+
+Destinos:
+  - dispositivo: archivo de dispositivo de la impresora térmica
+    (p. ej. /dev/usb/lp0 en Linux o LPT1 en Windows); recibe los bytes ESC/POS.
+  - directorio: carpeta de spool; cada recibo se escribe completo con un nombre
+    temporal y luego se renombra, así quien la vigile nunca lee uno a medias.
+
+Uso manual (reimprimir una venta):
+    python recibos.py --db pos_data.db --venta 123 --destino recibos
+"""
+import argparse
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from operaciones import parsear_detalles
+from repositorio import Repositorio
+
+try:
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    PDF_DISPONIBLE = True
+except ImportError:
+    PDF_DISPONIBLE = False
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_RECIBO = ("escpos", "pdf")
+ENCABEZADO = ("TIENDA", "Sistema de Punto de Venta")
+PIE = ("¡Gracias por su compra!",)
+
+# Columnas por línea según el papel (fuente A): 80 mm -> 48, 58 mm -> 32
+COLUMNAS_PAPEL = {80: 48, 58: 32}
+
+# Comandos ESC/POS
+ESC_INICIALIZAR = b"\x1b@"
+ESC_TABLA_CP850 = b"\x1bt\x02"
+ESC_CENTRAR = b"\x1ba\x01"
+ESC_IZQUIERDA = b"\x1ba\x00"
+ESC_NEGRITA = b"\x1bE\x01"
+ESC_NORMAL = b"\x1bE\x00"
+ESC_DOBLE_ALTO = b"\x1d!\x01"
+ESC_TAMANO_NORMAL = b"\x1d!\x00"
+ESC_AVANZAR_Y_CORTAR = b"\x1bd\x04\x1dVB\x00"
+CODIFICACION_ESCPOS = "cp850"
+
+
+# ====================================================================
+#           PLANTILLAS (compiladas una vez y en caché)
+# ====================================================================
+
+class PlantillaEscPos:
+    def __init__(self, columnas, encabezado, pie):
+        self.columnas = columnas
+        ancho_nombre = columnas - 14
+        # "nombre ... cant x precio" en una línea, con el nombre recortado al ancho disponible
+        self.formato_linea = f"{{:<{ancho_nombre}.{ancho_nombre}}}{{:>14}}\n"
+        self.formato_total = f"{{:<{columnas - 16}}}{{:>16}}\n"
+        self.separador = self._texto("-" * columnas + "\n")
+
+        self.inicio = b"".join([ESC_INICIALIZAR, ESC_TABLA_CP850, ESC_CENTRAR, ESC_NEGRITA, ESC_DOBLE_ALTO,
+                                self._texto(encabezado[0] + "\n"), ESC_TAMANO_NORMAL, ESC_NORMAL,
+                                *(self._texto(linea + "\n") for linea in encabezado[1:]),
+                                ESC_IZQUIERDA, self.separador])
+        self.fin = b"".join([self.separador, ESC_CENTRAR, *(self._texto(linea + "\n") for linea in pie),
+                             ESC_IZQUIERDA, ESC_AVANZAR_Y_CORTAR])
+
+    @staticmethod
+    def _texto(texto):
+        return texto.encode(CODIFICACION_ESCPOS, errors="replace")
+
+    def renderizar(self, venta, reimpresion=False):
+        venta_id, fecha, total, detalles, es_devolucion = venta
+        partes = [self.inicio, self._texto(f"Venta #{venta_id}\n{fecha}\n")]
+        if reimpresion:
+            partes.append(ESC_NEGRITA + self._texto("*** REIMPRESIÓN ***\n") + ESC_NORMAL)
+        if es_devolucion:
+            partes.append(ESC_NEGRITA + self._texto("*** VENTA DEVUELTA ***\n") + ESC_NORMAL)
+        partes.append(self.separador)
+        for nombre, cantidad, precio in parsear_detalles(detalles):
+            partes.append(self._texto(self.formato_linea.format(nombre, f"{cantidad} x {precio}")))
+        partes.append(self.separador)
+        partes.append(ESC_NEGRITA + ESC_DOBLE_ALTO + self._texto(self.formato_total.format("TOTAL", f"C${total:.2f}"))
+                      + ESC_TAMANO_NORMAL + ESC_NORMAL)
+        partes.append(self.fin)
+        return b"".join(partes)
+
+
+class PlantillaPdf:
+    """Ticket PDF del ancho del papel; el alto se ajusta al número de líneas."""
+
+    def __init__(self, ancho_mm, encabezado, pie):
+        self.ancho = ancho_mm * mm
+        self.margen = 4 * mm
+        self.interlinea = 4 * mm
+        self.encabezado = encabezado
+        self.pie = pie
+        self.columna_derecha = self.ancho - self.margen
+        # Caracteres de nombre que caben junto a "cant x precio" en Helvetica 8
+        self.ancho_nombre = max(int((self.ancho - 2 * self.margen) / (8 * 0.5)) - 16, 8)
+
+    def renderizar(self, ruta, venta, reimpresion=False):
+        venta_id, fecha, total, detalles, es_devolucion = venta
+        lineas = parsear_detalles(detalles)
+        marcas = [texto for activo, texto in ((reimpresion, "*** REIMPRESIÓN ***"),
+                                               (es_devolucion, "*** VENTA DEVUELTA ***")) if activo]
+        filas = len(self.encabezado) + 2 + len(marcas) + len(lineas) + 2 + len(self.pie) + 2
+        alto = filas * self.interlinea + 2 * self.margen
+
+        c = canvas.Canvas(ruta, pagesize=(self.ancho, alto))
+        y = alto - self.margen - self.interlinea
+        centro = self.ancho / 2
+
+        c.setFont("Helvetica-Bold", 11)
+        c.drawCentredString(centro, y, self.encabezado[0])
+        c.setFont("Helvetica", 8)
+        for texto in (*self.encabezado[1:], f"Venta #{venta_id}", fecha, *marcas):
+            y -= self.interlinea
+            c.drawCentredString(centro, y, texto)
+        y -= self.interlinea
+        c.line(self.margen, y + self.interlinea / 2, self.columna_derecha, y + self.interlinea / 2)
+        for nombre, cantidad, precio in lineas:
+            c.drawString(self.margen, y, nombre[:self.ancho_nombre])
+            c.drawRightString(self.columna_derecha, y, f"{cantidad} x {precio}")
+            y -= self.interlinea
+        c.line(self.margen, y + self.interlinea / 2, self.columna_derecha, y + self.interlinea / 2)
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(self.margen, y - self.interlinea / 2, "TOTAL")
+        c.drawRightString(self.columna_derecha, y - self.interlinea / 2, f"C${total:.2f}")
+        c.setFont("Helvetica", 8)
+        y -= self.interlinea
+        for texto in self.pie:
+            y -= self.interlinea
+            c.drawCentredString(centro, y, texto)
+        c.showPage()
+        c.save()
+
+
+@functools.lru_cache(maxsize=None)
+def plantilla_escpos(ancho_mm=80, encabezado=ENCABEZADO, pie=PIE):
+    return PlantillaEscPos(COLUMNAS_PAPEL.get(ancho_mm, 48), encabezado, pie)
+
+
+@functools.lru_cache(maxsize=None)
+def plantilla_pdf(ancho_mm=80, encabezado=ENCABEZADO, pie=PIE):
+    return PlantillaPdf(ancho_mm, encabezado, pie)
+
+
+# ====================================================================
+#           SPOOL Y COLA EN SEGUNDO PLANO
+# ====================================================================
+
+def escribir_en_spool(directorio, nombre, datos):
+    """Escribe el recibo completo con nombre temporal y lo publica con un rename atómico."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, nombre)
+    temporal = ruta + ".tmp"
+    with open(temporal, "wb") as archivo:
+        archivo.write(datos)
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def escribir_en_dispositivo(dispositivo, datos):
+    with open(dispositivo, "wb", buffering=0) as impresora:
+        impresora.write(datos)
+    return dispositivo
+
+
+class ColaRecibos:
+    def __init__(self, directorio="recibos", dispositivo=None, formatos=("escpos",), ancho_mm=80):
+        self.directorio = directorio
+        self.dispositivo = dispositivo
+        self.formatos = tuple(f for f in formatos if f != "pdf" or PDF_DISPONIBLE)
+        self.ancho_mm = ancho_mm
+        self.impresos = 0
+        self.errores = 0
+
+        self._cola = queue.Queue()
+        self._hilo = None
+
+        if "pdf" in formatos and not PDF_DISPONIBLE:
+            logger.warning("Recibos en PDF desactivados: falta 'reportlab'.")
+        # Compila las plantillas ahora y no con la primera venta
+        plantilla_escpos(ancho_mm)
+        if "pdf" in self.formatos:
+            plantilla_pdf(ancho_mm)
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="recibos-pos", daemon=True)
+            self._hilo.start()
+
+    def detener(self, espera=5):
+        """Termina de imprimir lo que queda en cola (hasta 'espera' segundos) y detiene el hilo."""
+        if self._hilo is not None:
+            self._cola.put(None)
+            self._hilo.join(espera)
+            self._hilo = None
+
+    def encolar(self, venta, reimpresion=False):
+        """venta = (id, fecha, total, detalles, es_devolucion). Vuelve de inmediato."""
+        self._cola.put((venta, reimpresion))
+
+    @property
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def _bucle(self):
+        while True:
+            pedido = self._cola.get()
+            if pedido is None:
+                break
+            venta, reimpresion = pedido
+            try:
+                self.imprimir(venta, reimpresion)
+                self.impresos += 1
+            except Exception:
+                self.errores += 1
+                logger.exception("No se pudo imprimir el recibo de la venta #%s", venta[0])
+
+    def imprimir(self, venta, reimpresion=False):
+        """Renderiza y envía el recibo en todos los formatos configurados. Devuelve los destinos escritos."""
+        inicio = time.perf_counter()
+        venta_id = venta[0]
+        sufijo = f"_r{int(time.time())}" if reimpresion else ""
+        destinos = []
+
+        if "escpos" in self.formatos:
+            datos = plantilla_escpos(self.ancho_mm).renderizar(venta, reimpresion)
+            if self.dispositivo:
+                destinos.append(escribir_en_dispositivo(self.dispositivo, datos))
+            else:
+                destinos.append(escribir_en_spool(self.directorio, f"recibo_{venta_id:08d}{sufijo}.bin", datos))
+
+        if "pdf" in self.formatos:
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = os.path.join(self.directorio, f"recibo_{venta_id:08d}{sufijo}.pdf")
+            plantilla_pdf(self.ancho_mm).renderizar(ruta + ".tmp", venta, reimpresion)
+            os.replace(ruta + ".tmp", ruta)
+            destinos.append(ruta)
+
+        logger.info("Recibo de la venta #%d en %.1f ms -> %s", venta_id, (time.perf_counter() - inicio) * 1000,
+                    ", ".join(destinos))
+        return destinos
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Reimprime el recibo de una venta del POS.")
+    parser.add_argument("--db", default="pos_data.db", help="Base de datos del POS")
+    parser.add_argument("--venta", type=int, required=True, help="ID de la venta")
+    parser.add_argument("--destino", default="recibos", help="Carpeta de spool")
+    parser.add_argument("--dispositivo", default=None, help="Archivo de dispositivo de la impresora (en vez del spool)")
+    parser.add_argument("--formatos", default="escpos", help="Formatos separados por coma (escpos,pdf)")
+    parser.add_argument("--ancho", type=int, default=80, choices=sorted(COLUMNAS_PAPEL), help="Ancho del papel en mm")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        venta = Repositorio(conn).ventas.obtener(args.venta)
+    finally:
+        conn.close()
+    if venta is None:
+        parser.error(f"La venta ID {args.venta} no existe.")
+
+    cola = ColaRecibos(args.destino, args.dispositivo, args.formatos.split(","), args.ancho)
+    print("\n".join(cola.imprimir(venta, reimpresion=True)))
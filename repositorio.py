@@ -0,0 +1,499 @@
+"""Capa de acceso a datos del POS: productos, ventas, cajas y libro de stock.
+
+Todo el SQL de la aplicación pasa por aquí, siempre con parámetros (ningún
+valor del usuario se interpola en el texto). Los textos SQL son constantes o,
+los que varían por orden o filtros, se arman una sola vez por combinación
+(lru_cache), así el conjunto de sentencias distintas es fijo y entra en la
+caché de sentencias de la conexión (SENTENCIAS_EN_CACHE): SQLite no vuelve a
+preparar nada al escribir en la búsqueda.
+
+Las consultas devuelven namedtuples (Producto, Venta, Caja, ...), que siguen
+siendo tuplas para el Treeview. Repositorio.consultar/ejecutar es el único
+punto donde se mide el tiempo de cada operación y se reintenta si la base
+está bloqueada por otro proceso (respaldo, mantenimiento, consolidación).
+Ningún método hace commit: quien llama confirma la transacción.
+"""
+import datetime
+import functools
+import logging
+import re
+import sqlite3
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Sentencias distintas: ~40 fijas + 20 páginas de productos (5 columnas x 2 sentidos x con/sin filtro)
+# + 13 búsquedas de ventas ((FTS + 1 a MAX_PALABRAS_LIKE LIKE + sin texto) x con/sin total, más solo total
+# por su índice; el rango de fechas va como parámetro); 128 deja margen.
+SENTENCIAS_EN_CACHE = 128
+
+# Reintentos ante 'database is locked' (después del busy_timeout del perfil de conexión)
+REINTENTOS = 3
+PAUSA_REINTENTO = 0.05
+
+# Operaciones más lentas que esto quedan en el log
+OPERACION_LENTA_MS = 50
+
+# Columna del Treeview de productos -> expresión SQL para ORDER BY (lista blanca, cada una con su índice)
+ORDEN_PRODUCTOS = {
+    "ID": "id",
+    "Nombre": "nombre COLLATE NOCASE",
+    "Categoría": "categoria COLLATE NOCASE",
+    "Stock": "stock",
+    "Precio": "precio",
+}
+
+# Máximo de ventas que devuelve una búsqueda en el historial
+LIMITE_BUSQUEDA_VENTAS = 500
+
+# Sin FTS5, palabras de la búsqueda que se filtran con LIKE (las siguientes se ignoran)
+MAX_PALABRAS_LIKE = 4
+
+# Búsqueda solo por total mínimo: con menos coincidencias que esto se leen por idx_ventas_total y se
+# ordenan; con más, recorrer por id desde la más reciente llega antes a LIMIT (cruce medido: ~8000 en 1M)
+UMBRAL_INDICE_TOTAL = 10000
+
+Producto = namedtuple("Producto", "id nombre categoria descripcion stock precio")
+ProductoListado = namedtuple("ProductoListado", "id nombre categoria stock precio")
+ProductoVenta = namedtuple("ProductoVenta", "id nombre stock precio")
+Venta = namedtuple("Venta", "id fecha total detalles es_devolucion")
+VentaExportacion = namedtuple("VentaExportacion", "id fecha total detalles es_devolucion fecha_devolucion")
+# devoluciones_en_marca: ids (separados por coma) de las devoluciones del segundo 'ultima_devolucion'
+# que ya se exportaron; ese segundo se relee en la siguiente exportación
+MarcaExportacion = namedtuple("MarcaExportacion", "ultimo_id ultima_devolucion archivo devoluciones_en_marca")
+Caja = namedtuple("Caja", "id estado fecha_apertura fecha_cierre ganancia_total")
+StockAFecha = namedtuple("StockAFecha", "id nombre stock")
+
+
+class Repositorio:
+    """Punto de entrada: repo.productos, repo.ventas, repo.cajas y repo.stock sobre una misma conexión."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.tiempos = {}  # operación -> [llamadas, ms totales, ms máximo]
+
+        self.productos = RepositorioProductos(self)
+        self.ventas = RepositorioVentas(self)
+        self.cajas = RepositorioCajas(self)
+        self.stock = RepositorioStock(self)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def ejecutar(self, operacion, sql, params=(), muchos=False):
+        """Ejecuta una sentencia midiendo su tiempo; devuelve el cursor (lastrowid, rowcount)."""
+        inicio = time.perf_counter()
+        for intento in range(REINTENTOS + 1):
+            # Solo se reintenta si la sentencia abre la transacción: dentro de una ya empezada
+            # el bloqueo no se libera esperando y hay que deshacerla entera.
+            en_transaccion = self.conn.in_transaction
+            try:
+                if muchos:
+                    self.cursor.executemany(sql, params)
+                else:
+                    self.cursor.execute(sql, params)
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or en_transaccion or intento == REINTENTOS:
+                    raise
+                logger.warning("%s: base bloqueada, reintento %d de %d", operacion, intento + 1, REINTENTOS)
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                time.sleep(PAUSA_REINTENTO * 2 ** intento)
+        self._medir(operacion, inicio)
+        return self.cursor
+
+    def consultar(self, operacion, sql, params=(), fila=None):
+        """Todas las filas de la consulta, como 'fila' (namedtuple) si se indica."""
+        inicio = time.perf_counter()
+        for intento in range(REINTENTOS + 1):
+            try:
+                filas = self.cursor.execute(sql, params).fetchall()
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or self.conn.in_transaction or intento == REINTENTOS:
+                    raise
+                logger.warning("%s: base bloqueada, reintento %d de %d", operacion, intento + 1, REINTENTOS)
+                time.sleep(PAUSA_REINTENTO * 2 ** intento)
+        self._medir(operacion, inicio)
+        return list(map(fila._make, filas)) if fila else filas
+
+    def consultar_uno(self, operacion, sql, params=(), fila=None):
+        filas = self.consultar(operacion, sql, params, fila)
+        return filas[0] if filas else None
+
+    def _medir(self, operacion, inicio):
+        ms = (time.perf_counter() - inicio) * 1000
+        tiempo = self.tiempos.setdefault(operacion, [0, 0.0, 0.0])
+        tiempo[0] += 1
+        tiempo[1] += ms
+        tiempo[2] = max(tiempo[2], ms)
+        if ms > OPERACION_LENTA_MS:
+            logger.warning("Operación lenta %s: %.1f ms", operacion, ms)
+
+    def resumen_tiempos(self):
+        """Líneas 'operación: llamadas, promedio y máximo' ordenadas por tiempo total."""
+        return [f"{operacion}: {llamadas} llamadas, {total / llamadas:.2f} ms prom., {maximo:.2f} ms máx."
+                for operacion, (llamadas, total, maximo)
+                in sorted(self.tiempos.items(), key=lambda item: -item[1][1])]
+
+
+class _Tabla:
+    def __init__(self, repo):
+        self.repo = repo
+
+
+# ====================================================================
+#           PRODUCTOS
+# ====================================================================
+
+@functools.lru_cache(maxsize=None)
+def _sql_pagina_productos(columna, descendente, con_filtro):
+    direccion = "DESC" if descendente else "ASC"
+    sql = "SELECT id, nombre, categoria, stock, precio FROM productos"
+    if con_filtro:
+        sql += " WHERE nombre LIKE ? OR categoria LIKE ? OR id LIKE ?"
+    return sql + f" ORDER BY {ORDEN_PRODUCTOS[columna]} {direccion}, id {direccion} LIMIT ? OFFSET ?"
+
+
+class RepositorioProductos(_Tabla):
+    def obtener(self, producto_id):
+        """Producto o None."""
+        return self.repo.consultar_uno(
+            "productos.obtener",
+            "SELECT id, nombre, categoria, descripcion, stock, precio FROM productos WHERE id=?",
+            (producto_id,), Producto)
+
+    def buscar_para_venta(self, termino):
+        """Primer producto cuyo ID es 'termino' o cuyo nombre lo contiene: ProductoVenta o None."""
+        return self.repo.consultar_uno(
+            "productos.buscar_para_venta",
+            "SELECT id, nombre, stock, precio FROM productos WHERE id=? OR nombre LIKE ? LIMIT 1",
+            (termino, f'%{termino}%'), ProductoVenta)
+
+    def pagina(self, busqueda="", columna="ID", descendente=False, offset=0, limite=200):
+        """Página de ProductoListado filtrada y ordenada en SQLite (con índice por columna)."""
+        params = [f'%{busqueda}%', f'%{busqueda}%', f'{busqueda}%'] if busqueda else []
+        return self.repo.consultar("productos.pagina", _sql_pagina_productos(columna, descendente, bool(busqueda)),
+                                   params + [limite, offset], ProductoListado)
+
+    def ids(self):
+        return [fila[0] for fila in self.repo.consultar("productos.ids", "SELECT id FROM productos ORDER BY id")]
+
+    def contar(self):
+        return self.repo.consultar("productos.contar", "SELECT COUNT(*) FROM productos")[0][0]
+
+    def stock(self, producto_id):
+        """Stock actual o None si el producto no existe."""
+        fila = self.repo.consultar_uno("productos.stock", "SELECT stock FROM productos WHERE id=?", (producto_id,))
+        return fila[0] if fila else None
+
+    def id_por_nombre(self, nombre):
+        fila = self.repo.consultar_uno("productos.id_por_nombre", "SELECT id FROM productos WHERE nombre=?",
+                                       (nombre,))
+        return fila[0] if fila else None
+
+    def insertar(self, nombre, categoria, descripcion, stock, precio):
+        """Devuelve el id del producto nuevo."""
+        return self.repo.ejecutar(
+            "productos.insertar",
+            "INSERT INTO productos (nombre, categoria, descripcion, stock, precio) VALUES (?, ?, ?, ?, ?)",
+            (nombre, categoria, descripcion, stock, precio)).lastrowid
+
+    def insertar_varios(self, filas):
+        """filas: (nombre, categoria, descripcion, stock, precio) por producto."""
+        self.repo.ejecutar(
+            "productos.insertar_varios",
+            "INSERT INTO productos (nombre, categoria, descripcion, stock, precio) VALUES (?, ?, ?, ?, ?)",
+            filas, muchos=True)
+
+    def actualizar(self, producto_id, nombre, categoria, descripcion, precio):
+        # El stock no se edita aquí: cambia solo con ventas, devoluciones y recepciones
+        self.repo.ejecutar("productos.actualizar",
+                           "UPDATE productos SET nombre=?, categoria=?, descripcion=?, precio=? WHERE id=?",
+                           (nombre, categoria, descripcion, precio, producto_id))
+
+    def eliminar(self, producto_id):
+        self.repo.ejecutar("productos.eliminar", "DELETE FROM productos WHERE id=?", (producto_id,))
+
+    def sumar_stock(self, producto_id, cantidad):
+        """Suma (o resta, con cantidad negativa) al stock del producto."""
+        self.repo.ejecutar("productos.sumar_stock", "UPDATE productos SET stock = stock + ? WHERE id=?",
+                           (cantidad, producto_id))
+
+
+# ====================================================================
+#           VENTAS Y MARCAS DE EXPORTACIÓN
+# ====================================================================
+
+# Cotas de id cuando la búsqueda no tiene filtro de fecha
+ID_MINIMO = 0
+ID_MAXIMO = 2 ** 63 - 1
+
+
+@functools.lru_cache(maxsize=None)
+def _sql_buscar_ventas(texto, palabras, total_min):
+    # texto: 'fts', 'like' o None; palabras: cantidad de condiciones LIKE (como mucho MAX_PALABRAS_LIKE).
+    # El rango de fechas llega ya convertido en rango de id: con FTS5 la restricción sobre rowid y el
+    # ORDER BY rowid DESC los resuelve el propio índice, que entrega las coincidencias de la más
+    # reciente hacia atrás y se detiene en LIMIT en lugar de ordenar todas.
+    if texto == "total":
+        # Solo total mínimo y pocas ventas lo superan (ver RepositorioVentas.buscar)
+        return ("SELECT v.id, v.fecha, v.total, v.detalles, v.es_devolucion FROM ventas v "
+                "INDEXED BY idx_ventas_total WHERE v.total >= ? ORDER BY v.id DESC LIMIT ?")
+    if texto == "fts":
+        sql = ("SELECT v.id, v.fecha, v.total, v.detalles, v.es_devolucion "
+               "FROM ventas_fts JOIN ventas v ON v.id = ventas_fts.rowid")
+        condiciones = ["ventas_fts MATCH ?", "ventas_fts.rowid BETWEEN ? AND ?"]
+        orden = "ventas_fts.rowid"
+    else:
+        sql = "SELECT v.id, v.fecha, v.total, v.detalles, v.es_devolucion FROM ventas v"
+        condiciones = ["v.detalles LIKE ?"] * palabras + ["v.id BETWEEN ? AND ?"]
+        orden = "v.id"
+    if total_min:
+        condiciones.append("v.total >= ?")
+    return sql + " WHERE " + " AND ".join(condiciones) + f" ORDER BY {orden} DESC LIMIT ?"
+
+
+class RepositorioVentas(_Tabla):
+    def obtener(self, venta_id):
+        """Venta o None."""
+        return self.repo.consultar_uno(
+            "ventas.obtener", "SELECT id, fecha, total, detalles, es_devolucion FROM ventas WHERE id=?",
+            (venta_id,), Venta)
+
+    def recientes(self, limite=LIMITE_BUSQUEDA_VENTAS):
+        """Las últimas 'limite' ventas, de la más reciente a la más antigua."""
+        return self.repo.consultar(
+            "ventas.recientes",
+            "SELECT id, fecha, total, detalles, es_devolucion FROM ventas ORDER BY id DESC LIMIT ?",
+            (limite,), Venta)
+
+    def buscar(self, fts_ventas, texto="", desde=None, hasta=None, total_min=None, limite=LIMITE_BUSQUEDA_VENTAS):
+        """Ventas que contienen todas las palabras de 'texto' (por prefijo) y cumplen los filtros.
+
+        Con FTS5 el texto se resuelve en el índice invertido; sin él se filtra con LIKE por las primeras
+        MAX_PALABRAS_LIKE palabras. El rango de fechas se convierte en rango de id.
+        """
+        palabras = re.findall(r"\w+", texto)
+        if total_min is not None and not (palabras or desde or hasta) and self._pocas_con_total(total_min):
+            return self.repo.consultar("ventas.buscar", _sql_buscar_ventas("total", 0, True),
+                                       (total_min, limite), Venta)
+
+        desde_id, hasta_id = self._rango_ids(desde, hasta)
+        if desde_id is None:
+            return []  # Ninguna venta en el rango de fechas
+
+        params = []
+        if palabras and fts_ventas:
+            modo = "fts"
+            params.append(" ".join(f'"{palabra}"*' for palabra in palabras))
+        else:
+            # Una condición por palabra, hasta MAX_PALABRAS_LIKE: así hay pocos textos SQL distintos
+            palabras = palabras[:MAX_PALABRAS_LIKE]
+            modo = "like" if palabras else None
+            params += [f"%{palabra}%" for palabra in palabras]
+        params += [desde_id, hasta_id]
+        if total_min is not None:
+            params.append(total_min)
+        params.append(limite)
+
+        sql = _sql_buscar_ventas(modo, len(palabras) if modo == "like" else 0, total_min is not None)
+        return self.repo.consultar("ventas.buscar", sql, params, Venta)
+
+    def _pocas_con_total(self, total_min):
+        # Cuenta por el índice, sin pasar de UMBRAL_INDICE_TOTAL: cuesta lo mismo con cualquier historial
+        return self.repo.consultar_uno(
+            "ventas.contar_por_total",
+            "SELECT COUNT(*) FROM (SELECT 1 FROM ventas INDEXED BY idx_ventas_total WHERE total >= ? LIMIT ?)",
+            (total_min, UMBRAL_INDICE_TOTAL))[0] < UMBRAL_INDICE_TOTAL
+
+    def _rango_ids(self, desde, hasta):
+        """(primer id, último id) de las ventas entre las fechas, por idx_ventas_fecha; (None, None) si no hay.
+
+        Las ventas se insertan con la hora actual, así que el id crece con la fecha.
+        """
+        desde_id, hasta_id = ID_MINIMO, ID_MAXIMO
+        if desde:
+            fila = self.repo.consultar_uno(
+                "ventas.primer_id_desde", "SELECT id FROM ventas WHERE fecha >= ? ORDER BY fecha, id LIMIT 1",
+                (desde.strftime("%Y-%m-%d"),))
+            if fila is None:
+                return None, None
+            desde_id = fila[0]
+        if hasta:
+            # La fecha se guarda como 'AAAA-MM-DD HH:MM:SS': se incluye el día completo
+            fila = self.repo.consultar_uno(
+                "ventas.ultimo_id_hasta",
+                "SELECT id FROM ventas WHERE fecha < ? ORDER BY fecha DESC, id DESC LIMIT 1",
+                ((hasta + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),))
+            if fila is None or fila[0] < desde_id:
+                return None, None
+            hasta_id = fila[0]
+        return desde_id, hasta_id
+
+    def insertar(self, fecha, total, detalles):
+        """Devuelve el id de la venta nueva."""
+        return self.repo.ejecutar("ventas.insertar", "INSERT INTO ventas (fecha, total, detalles) VALUES (?, ?, ?)",
+                                  (fecha, total, detalles)).lastrowid
+
+    def marcar_devolucion(self, venta_id, fecha):
+        self.repo.ejecutar("ventas.marcar_devolucion",
+                           "UPDATE ventas SET es_devolucion=1, fecha_devolucion=? WHERE id=?", (fecha, venta_id))
+
+    def para_exportar(self, marca=None):
+        """VentaExportacion. Sin 'marca', todas (la más reciente primero); con ella, solo las de id
+        mayor y las anteriores devueltas desde 'ultima_devolucion' que aún no se exportaron, en orden de id."""
+        if marca is None:
+            return self.repo.consultar(
+                "ventas.para_exportar",
+                "SELECT id, fecha, total, detalles, es_devolucion, fecha_devolucion FROM ventas ORDER BY id DESC",
+                fila=VentaExportacion)
+        # Sin ORDER BY SQLite resuelve el OR con dos búsquedas por índice (rowid y fecha_devolucion);
+        # el lote es pequeño y se ordena aquí.
+        # '>=': la fecha tiene resolución de un segundo, así que se relee el segundo de la marca (una
+        # devolución confirmada en ese mismo segundo después de exportar no se pierde) y se descartan
+        # las que ya salieron en la exportación anterior.
+        filas = self.repo.consultar(
+            "ventas.para_exportar_desde",
+            "SELECT id, fecha, total, detalles, es_devolucion, fecha_devolucion FROM ventas "
+            "WHERE id > ? OR fecha_devolucion >= ?",
+            (marca.ultimo_id, marca.ultima_devolucion), VentaExportacion)
+        ya_exportadas = _ids_en_marca(marca)
+        return sorted(fila for fila in filas
+                      if fila.id > marca.ultimo_id or fila.fecha_devolucion != marca.ultima_devolucion
+                      or fila.id not in ya_exportadas)
+
+    def marca_exportacion(self, formato):
+        return self.repo.consultar_uno(
+            "ventas.marca_exportacion",
+            "SELECT ultimo_id, ultima_devolucion, archivo, devoluciones_en_marca FROM exportaciones WHERE formato=?",
+            (formato,), MarcaExportacion) or MarcaExportacion(0, '', None, '')
+
+    def guardar_marca_exportacion(self, formato, marca, fecha):
+        self.repo.ejecutar(
+            "ventas.guardar_marca_exportacion",
+            "INSERT OR REPLACE INTO exportaciones "
+            "(formato, ultimo_id, ultima_devolucion, archivo, devoluciones_en_marca, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+            (formato, marca.ultimo_id, marca.ultima_devolucion, marca.archivo, marca.devoluciones_en_marca, fecha))
+
+
+def _ids_en_marca(marca):
+    return {int(venta_id) for venta_id in marca.devoluciones_en_marca.split(",") if venta_id}
+
+
+def siguiente_marca_exportacion(marca, filas, archivo):
+    """Marca que deja una exportación incremental de 'filas' (VentaExportacion) hecha desde 'marca'."""
+    ultima_devolucion = max([marca.ultima_devolucion] + [fila.fecha_devolucion for fila in filas
+                                                         if fila.fecha_devolucion])
+    en_marca = {fila.id for fila in filas if fila.fecha_devolucion == ultima_devolucion}
+    if ultima_devolucion == marca.ultima_devolucion:
+        en_marca |= _ids_en_marca(marca)
+    return MarcaExportacion(max([marca.ultimo_id] + [fila.id for fila in filas]), ultima_devolucion, archivo,
+                            ",".join(str(venta_id) for venta_id in sorted(en_marca)))
+
+
+# ====================================================================
+#           CAJAS
+# ====================================================================
+
+class RepositorioCajas(_Tabla):
+    def obtener(self, caja_id):
+        """Caja o None."""
+        return self.repo.consultar_uno(
+            "cajas.obtener", "SELECT id, estado, fecha_apertura, fecha_cierre, ganancia_total FROM caja WHERE id=?",
+            (caja_id,), Caja)
+
+    def abierta(self):
+        """Última caja abierta o None."""
+        return self.repo.consultar_uno(
+            "cajas.abierta",
+            "SELECT id, estado, fecha_apertura, fecha_cierre, ganancia_total FROM caja "
+            "WHERE estado='Abierta' ORDER BY id DESC LIMIT 1",
+            fila=Caja)
+
+    def todas(self):
+        return self.repo.consultar(
+            "cajas.todas",
+            "SELECT id, estado, fecha_apertura, fecha_cierre, ganancia_total FROM caja ORDER BY id DESC",
+            fila=Caja)
+
+    def abrir(self, fecha):
+        """Devuelve el id de la caja nueva."""
+        return self.repo.ejecutar("cajas.abrir",
+                                  "INSERT INTO caja (estado, fecha_apertura, ganancia_total) VALUES ('Abierta', ?, 0)",
+                                  (fecha,)).lastrowid
+
+    def cerrar(self, caja_id, fecha, ganancia_total):
+        self.repo.ejecutar("cajas.cerrar",
+                           "UPDATE caja SET estado='Cerrada', fecha_cierre=?, ganancia_total=? WHERE id=?",
+                           (fecha, ganancia_total, caja_id))
+
+    def sumar_ganancia(self, caja_id, monto):
+        self.repo.ejecutar("cajas.sumar_ganancia", "UPDATE caja SET ganancia_total = ganancia_total + ? WHERE id=?",
+                           (monto, caja_id))
+
+
+# ====================================================================
+#           LIBRO DE MOVIMIENTOS DE STOCK E INSTANTÁNEAS
+# ====================================================================
+
+class RepositorioStock(_Tabla):
+    def registrar_movimiento(self, producto_id, cantidad, tipo, fecha, referencia=None):
+        """Anota un cambio de stock (positivo o negativo). Debe ir en la misma transacción que el UPDATE."""
+        self.repo.ejecutar(
+            "stock.registrar_movimiento",
+            "INSERT INTO movimientos_stock (producto_id, fecha, cantidad, tipo, referencia) VALUES (?, ?, ?, ?, ?)",
+            (producto_id, fecha, cantidad, tipo, referencia))
+
+    def tomar_snapshot(self, fecha):
+        """Guarda el stock actual de todos los productos junto con el último movimiento que ya incluye."""
+        # El primer INSERT abre la transacción, así el stock y el último movimiento leídos son consistentes
+        snapshot_id = self.repo.ejecutar(
+            "stock.tomar_snapshot",
+            "INSERT INTO snapshots_stock (fecha, ultimo_movimiento_id) "
+            "SELECT ?, COALESCE(MAX(id), 0) FROM movimientos_stock",
+            (fecha,)).lastrowid
+        self.repo.ejecutar(
+            "stock.tomar_snapshot_detalle",
+            "INSERT INTO snapshot_stock_detalle (snapshot_id, producto_id, stock) SELECT ?, id, stock FROM productos",
+            (snapshot_id,))
+        return snapshot_id
+
+    def hay_snapshot_desde(self, fecha):
+        return self.repo.consultar_uno("stock.hay_snapshot_desde",
+                                       "SELECT 1 FROM snapshots_stock WHERE fecha > ? LIMIT 1", (fecha,)) is not None
+
+    def a_fecha(self, fecha):
+        """StockAFecha de cada producto en 'fecha' (YYYY-MM-DD HH:MM:SS).
+
+        Parte de la última instantánea anterior a la fecha y suma solo los movimientos entre ella y la
+        siguiente (búsqueda por rango de id), en lugar de recorrer todo el libro.
+        """
+        snapshot = self.repo.consultar_uno(
+            "stock.ultimo_snapshot",
+            "SELECT id, ultimo_movimiento_id FROM snapshots_stock WHERE fecha <= ? ORDER BY fecha DESC LIMIT 1",
+            (fecha,)) or (None, 0)
+        # Los movimientos hasta 'fecha' ya están incluidos en la instantánea siguiente: cota superior del rango
+        hasta_id = self.repo.consultar_uno(
+            "stock.cota_movimientos",
+            "SELECT COALESCE((SELECT ultimo_movimiento_id FROM snapshots_stock WHERE fecha > ? "
+            "ORDER BY fecha LIMIT 1), (SELECT MAX(id) FROM movimientos_stock), 0)",
+            (fecha,))[0]
+        # NOT INDEXED: sin él SQLite elige idx_movimientos_producto (por el GROUP BY) y recorre todo el libro
+        return self.repo.consultar("stock.a_fecha", '''
+            SELECT p.id, p.nombre, COALESCE(s.stock, 0) + COALESCE(m.delta, 0)
+            FROM productos p
+            LEFT JOIN snapshot_stock_detalle s ON s.snapshot_id = ? AND s.producto_id = p.id
+            LEFT JOIN (
+                SELECT producto_id, SUM(cantidad) AS delta FROM movimientos_stock NOT INDEXED
+                WHERE id > ? AND id <= ? AND fecha <= ? GROUP BY producto_id
+            ) m ON m.producto_id = p.id
+            WHERE s.producto_id IS NOT NULL OR m.producto_id IS NOT NULL
+            ORDER BY p.id
+        ''', (snapshot[0], snapshot[1], hasta_id, fecha), StockAFecha)
@@ -0,0 +1,221 @@
+"""Respaldos en línea de pos_data.db usando la API de backup de SQLite.
+
+El respaldo se copia por pasos de pocas páginas desde un hilo en segundo plano,
+soltando el bloqueo de lectura entre paso y paso para que las ventas sigan
+confirmándose mientras tanto. Cada copia se verifica, se comprime (opcional)
+y se rota conservando solo las más recientes.
+
+Uso manual:
+    python respaldo.py --db pos_data.db --destino respaldos
+    python respaldo.py --verificar respaldos/pos_data_20240101_220000_000000.db.gz
+"""
+import argparse
+import datetime
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIJO_RESPALDO = "pos_data_"
+
+
+class RespaldoReiniciado(Exception):
+    """Otra conexión escribió durante la copia por pasos y SQLite la reinició desde el principio."""
+
+
+class GestorRespaldos:
+    def __init__(self, db_path, destino="respaldos", intervalo_min=60, conservar=7, comprimir=True,
+                 paginas_por_paso=64, pausa_entre_pasos=0.005, max_intentos=4):
+        self.db_path = db_path
+        self.destino = destino
+        self.intervalo = intervalo_min * 60
+        self.conservar = conservar
+        self.comprimir = comprimir
+        self.paginas_por_paso = paginas_por_paso
+        self.pausa_entre_pasos = pausa_entre_pasos
+        self.max_intentos = max_intentos
+
+        self.ultimo_respaldo = None  # Ruta del último respaldo verificado
+        self.respaldos_hechos = 0
+        self._lock = threading.Lock()  # Evita dos respaldos simultáneos (programado + manual)
+        self._detener = threading.Event()
+        self._solicitud = threading.Event()
+        self._hilo = None
+
+    # --- Programación en segundo plano ---
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="respaldos-pos", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5):
+        self._detener.set()
+        self._solicitud.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    @property
+    def en_curso(self):
+        """True mientras se copia, verifica o comprime un respaldo."""
+        return self._lock.locked()
+
+    def solicitar(self):
+        """Pide un respaldo inmediato al hilo de fondo (no bloquea la interfaz)."""
+        self._solicitud.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._solicitud.wait(self.intervalo)
+            self._solicitud.clear()
+            if self._detener.is_set():
+                break
+            try:
+                self.respaldar()
+            except Exception:
+                logger.exception("Falló el respaldo programado de %s", self.db_path)
+
+    # --- Respaldo, verificación y rotación ---
+
+    def respaldar(self):
+        """Copia la base de datos, la verifica, la comprime y rota las copias antiguas.
+
+        Devuelve la ruta del respaldo generado.
+        """
+        with self._lock:
+            os.makedirs(self.destino, exist_ok=True)
+            # Con microsegundos: dos respaldos en el mismo segundo (programado + botón) no se pisan.
+            # Los nombres siguen ordenándose por fecha junto a los antiguos, que no los tenían.
+            marca = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            ruta_db = os.path.join(self.destino, f"{PREFIJO_RESPALDO}{marca}.db")
+            for ruta in (ruta_db, ruta_db + ".gz"):
+                if os.path.exists(ruta):
+                    # Otro proceso (p. ej. respaldo.py a mano) eligió el mismo nombre: no se sobrescribe
+                    raise FileExistsError(f"El respaldo {ruta} ya existe.")
+
+            inicio = time.perf_counter()
+            self._copiar(ruta_db)
+
+            if not verificar_respaldo(ruta_db):
+                os.remove(ruta_db)
+                raise sqlite3.DatabaseError(f"El respaldo {ruta_db} no pasó la verificación de integridad.")
+
+            ruta_final = ruta_db
+            if self.comprimir:
+                ruta_final = ruta_db + ".gz"
+                with open(ruta_db, "rb") as origen, gzip.open(ruta_final, "wb") as comprimido:
+                    shutil.copyfileobj(origen, comprimido)
+                os.remove(ruta_db)
+
+            self.rotar()
+            self.ultimo_respaldo = ruta_final
+            self.respaldos_hechos += 1
+            logger.info("Respaldo %s creado en %.2f s (%d bytes)", ruta_final, time.perf_counter() - inicio,
+                        os.path.getsize(ruta_final))
+            return ruta_final
+
+    def _copiar(self, ruta_db):
+        origen = sqlite3.connect(self.db_path, timeout=30)
+        copia = sqlite3.connect(ruta_db)
+        try:
+            # Cada reinicio por escrituras concurrentes agranda el paso para terminar antes de la próxima venta
+            paginas = self.paginas_por_paso
+            for _ in range(self.max_intentos):
+                try:
+                    origen.backup(copia, pages=paginas, progress=self._progreso_por_pasos())
+                    break
+                except RespaldoReiniciado:
+                    paginas *= 8
+            else:
+                logger.warning("Respaldo reiniciado %d veces; se copia en un solo paso", self.max_intentos)
+                origen.backup(copia, pages=-1)
+            # La copia hereda el modo WAL del origen: se deja en modo clásico para que
+            # abrirla (verificación, restauración) no deje archivos -wal/-shm junto a ella
+            copia.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copia.close()
+            origen.close()
+
+    def _progreso_por_pasos(self):
+        # Si 'remaining' vuelve a crecer, SQLite reinició la copia porque otra conexión escribió
+        estado = {"restantes": None}
+
+        def progreso(status, remaining, total):
+            if estado["restantes"] is not None and remaining > estado["restantes"]:
+                raise RespaldoReiniciado()
+            estado["restantes"] = remaining
+            # Entre pasos no se tiene ningún bloqueo: se cede tiempo a finalizar_venta
+            time.sleep(self.pausa_entre_pasos)
+
+        return progreso
+
+    def rotar(self):
+        respaldos = listar_respaldos(self.destino)
+        for ruta in respaldos[:-self.conservar] if self.conservar > 0 else []:
+            os.remove(ruta)
+            logger.info("Respaldo antiguo eliminado: %s", ruta)
+
+
+def listar_respaldos(destino):
+    """Respaldos de la carpeta, del más antiguo al más reciente."""
+    # Solo copias completas: ni archivos -wal/-shm ni temporales cuentan como respaldo
+    return sorted(ruta for patron in ("*.db", "*.db.gz")
+                  for ruta in glob.glob(os.path.join(destino, PREFIJO_RESPALDO + patron)))
+
+
+def verificar_respaldo(ruta):
+    """Comprueba que el respaldo (.db o .db.gz) abre, pasa integrity_check y contiene el esquema del POS."""
+    ruta_temporal = None
+    try:
+        if ruta.endswith(".gz"):
+            descriptor, ruta_temporal = tempfile.mkstemp(suffix=".db")
+            with gzip.open(ruta, "rb") as comprimido, os.fdopen(descriptor, "wb") as destino:
+                shutil.copyfileobj(comprimido, destino)
+            ruta = ruta_temporal
+
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        try:
+            resultado = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if resultado != "ok":
+                logger.error("integrity_check de %s: %s", ruta, resultado)
+                return False
+            for tabla in ("productos", "ventas", "caja"):
+                conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()
+            return True
+        finally:
+            conn.close()
+    except (sqlite3.DatabaseError, OSError) as e:
+        logger.error("No se pudo verificar el respaldo %s: %s", ruta, e)
+        return False
+    finally:
+        if ruta_temporal:
+            os.remove(ruta_temporal)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Respaldo en línea de la base de datos del POS.")
+    parser.add_argument("--db", default="pos_data.db", help="Base de datos a respaldar")
+    parser.add_argument("--destino", default="respaldos", help="Carpeta de respaldos")
+    parser.add_argument("--conservar", type=int, default=7, help="Cantidad de respaldos a conservar")
+    parser.add_argument("--sin-compresion", action="store_true", help="No comprimir con gzip")
+    parser.add_argument("--verificar", metavar="ARCHIVO", help="Solo verificar un respaldo existente")
+    args = parser.parse_args()
+
+    if args.verificar:
+        ok = verificar_respaldo(args.verificar)
+        print("OK" if ok else "RESPALDO INVÁLIDO")
+        raise SystemExit(0 if ok else 1)
+
+    gestor = GestorRespaldos(args.db, args.destino, conservar=args.conservar, comprimir=not args.sin_compresion)
+    print(gestor.respaldar())
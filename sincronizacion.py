@@ -0,0 +1,183 @@
+"""Sincronización incremental de productos, ventas y caja con la oficina central.
+
+Los triggers creados por operaciones.crear_registro_cambios anotan en la tabla
+'cambios' cada alta, modificación o baja con un número de secuencia creciente.
+exportar_cambios() devuelve los cambios posteriores a un cursor en lotes: lee
+solo el tramo de 'cambios' pedido (por su clave) y el estado actual de esas
+filas (por id), así el costo depende de cuántos cambios hubo y no del tamaño
+de las tablas. Varias modificaciones de la misma fila en un lote se envían una
+sola vez, con su último estado.
+
+ReceptorCambios es el receptor local de prueba: aplica los lotes sobre una
+réplica y guarda su cursor en la misma transacción, así un lote repetido se
+ignora y uno fuera de orden se rechaza.
+
+Uso manual (replicar pos_data.db en replica.db hasta ponerse al día):
+    python sincronizacion.py --origen pos_data.db --destino replica.db --lote 1000
+"""
+import argparse
+import gzip
+import json
+import logging
+import sqlite3
+import time
+
+from mantenimiento import conectar
+from operaciones import TABLAS_CAMBIOS
+
+logger = logging.getLogger(__name__)
+
+LOTE_CAMBIOS = 1000
+
+
+# ====================================================================
+#           EXPORTACIÓN (lado de la tienda)
+# ====================================================================
+
+def exportar_cambios(conn, desde=0, limite=LOTE_CAMBIOS):
+    """Cambios con seq > desde, como máximo 'limite'.
+
+    Devuelve {"desde", "hasta", "hay_mas", "cambios": [[tabla, operacion, id, fila o None], ...]}
+    en orden de secuencia. 'hasta' es el cursor para pedir el lote siguiente.
+    """
+    conn.execute("BEGIN")  # El registro y las filas leídos en la misma foto
+    try:
+        registros = conn.execute(
+            "SELECT seq, tabla, fila_id, operacion FROM cambios WHERE seq > ? ORDER BY seq LIMIT ?",
+            (desde, limite)).fetchall()
+
+        # (tabla, id) -> última secuencia del lote; el estado se lee una vez por fila
+        ultimos = {}
+        for seq, tabla, fila_id, _ in registros:
+            ultimos[(tabla, fila_id)] = seq
+
+        filas = {}
+        for tabla, columnas in TABLAS_CAMBIOS.items():
+            ids = [fila_id for (nombre, fila_id) in ultimos if nombre == tabla]
+            if not ids:
+                continue
+            # json_each: el mismo texto SQL para cualquier cantidad de ids
+            for fila in conn.execute(
+                    f"SELECT {', '.join(columnas)} FROM {tabla} WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(ids),)):
+                filas[(tabla, fila[0])] = list(fila)
+    finally:
+        conn.execute("COMMIT")
+
+    cambios = []
+    for seq, tabla, fila_id, operacion in registros:
+        if ultimos[(tabla, fila_id)] != seq:
+            continue  # La fila cambió otra vez más adelante en este lote
+        fila = filas.get((tabla, fila_id))
+        # Si la fila ya no existe, lo que llega a la central es la baja
+        cambios.append([tabla, operacion if fila is not None else "D", fila_id, fila])
+
+    return {
+        "desde": desde,
+        "hasta": registros[-1][0] if registros else desde,
+        "hay_mas": len(registros) == limite,
+        "cambios": cambios,
+    }
+
+
+def purgar_cambios(conn, hasta):
+    """Borra del registro los cambios que el receptor ya confirmó (seq <= hasta)."""
+    with conn:
+        return conn.execute("DELETE FROM cambios WHERE seq <= ?", (hasta,)).rowcount
+
+
+def serializar_lote(lote):
+    return gzip.compress(json.dumps(lote, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def deserializar_lote(datos):
+    return json.loads(gzip.decompress(datos))
+
+
+# ====================================================================
+#           RECEPTOR LOCAL (réplica de prueba de la oficina central)
+# ====================================================================
+
+class ReceptorCambios:
+    def __init__(self, db_path, origen="pos"):
+        self.origen = origen
+        self.conn = conectar(db_path, timeout=30)
+        for tabla, columnas in TABLAS_CAMBIOS.items():
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {tabla} (id INTEGER PRIMARY KEY, "
+                              f"{', '.join(columnas[1:])})")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS cursor_sincronizacion (
+                origen TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    @property
+    def cursor(self):
+        fila = self.conn.execute("SELECT seq FROM cursor_sincronizacion WHERE origen=?", (self.origen,)).fetchone()
+        return fila[0] if fila else 0
+
+    def aplicar(self, lote):
+        """Aplica un lote y avanza el cursor. Devuelve los cambios aplicados (0 si el lote ya estaba aplicado)."""
+        actual = self.cursor
+        if lote["hasta"] <= actual:
+            return 0
+        if lote["desde"] != actual:
+            raise ValueError(f"Lote fuera de orden: empieza en {lote['desde']} y el receptor va en {actual}.")
+
+        with self.conn:
+            for tabla, operacion, fila_id, fila in lote["cambios"]:
+                if tabla not in TABLAS_CAMBIOS:
+                    raise ValueError(f"Tabla desconocida en el lote: {tabla}")
+                if operacion == "D":
+                    self.conn.execute(f"DELETE FROM {tabla} WHERE id=?", (fila_id,))
+                else:
+                    columnas = TABLAS_CAMBIOS[tabla]
+                    self.conn.execute(f"INSERT OR REPLACE INTO {tabla} ({', '.join(columnas)}) "
+                                      f"VALUES ({', '.join('?' * len(columnas))})", fila)
+            self.conn.execute("INSERT OR REPLACE INTO cursor_sincronizacion (origen, seq) VALUES (?, ?)",
+                              (self.origen, lote["hasta"]))
+        return len(lote["cambios"])
+
+    def cerrar(self):
+        self.conn.close()
+
+
+def sincronizar(origen_db, receptor, limite=LOTE_CAMBIOS, purgar=False):
+    """Envía lotes desde la base de la tienda al receptor hasta ponerse al día. Devuelve cambios aplicados."""
+    conn = sqlite3.connect(origen_db, timeout=30, isolation_level=None)
+    aplicados = 0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            datos = serializar_lote(exportar_cambios(conn, receptor.cursor, limite))
+            lote = deserializar_lote(datos)
+            aplicados += receptor.aplicar(lote)
+            logger.info("Lote %d..%d: %d cambios, %d bytes, %.1f ms", lote["desde"], lote["hasta"],
+                        len(lote["cambios"]), len(datos), (time.perf_counter() - inicio) * 1000)
+            if not lote["hay_mas"]:
+                break
+        if purgar:
+            purgar_cambios(conn, receptor.cursor)
+    finally:
+        conn.close()
+    return aplicados
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Replica los cambios de la base del POS en un receptor local.")
+    parser.add_argument("--origen", default="pos_data.db", help="Base de datos de la tienda")
+    parser.add_argument("--destino", default="replica.db", help="Base de datos del receptor")
+    parser.add_argument("--lote", type=int, default=LOTE_CAMBIOS, help="Cambios por lote")
+    parser.add_argument("--purgar", action="store_true", help="Borra del origen los cambios ya aplicados")
+    args = parser.parse_args()
+
+    receptor = ReceptorCambios(args.destino)
+    try:
+        print(f"{sincronizar(args.origen, receptor, args.lote, args.purgar)} cambios aplicados; "
+              f"cursor en {receptor.cursor}")
+    finally:
+        receptor.cerrar()